@@ -0,0 +1,117 @@
+import argparse
+import contextlib
+import importlib
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List
+from tqdm.auto import tqdm
+from replay import MarketReplay
+from simulator import commodities, replay_products, simulate
+import store
+
+
+def load_trader_class(spec : str):
+    """
+    Resolves a trader given either as a module ("general", uses its Trader class)
+    or as a dotted path to the class ("trader.Trader").
+    """
+    try:
+        return getattr(importlib.import_module(spec), "Trader")
+    except ModuleNotFoundError:
+        module_name, _, class_name = spec.rpartition(".")
+        if not module_name:
+            raise
+        return getattr(importlib.import_module(module_name), class_name)
+
+
+@contextlib.contextmanager
+def silenced():
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def trader_output(verbose : bool):
+    # Traders print a lot, only keep it when asked for
+    return contextlib.nullcontext() if verbose else silenced()
+
+
+@lru_cache(maxsize=None)
+def load_replay(filename : Path) -> MarketReplay:
+    # Every worker maps each day at most once, whatever the number of strategies
+    return store.load_replay(filename, replay_products)
+
+
+def max_drawdown(curve : np.ndarray) -> float:
+    return float(np.max(np.maximum.accumulate(curve) - curve))
+
+
+def summarize(profit_and_loss : np.ndarray) -> Dict[str, float]:
+    # Final profit of each commodity plus the drawdown of the summed curve
+    total = profit_and_loss.sum(axis=0)
+    summary = {c: float(profit_and_loss[k, -1]) for k, c in enumerate(commodities)}
+    summary["total"] = float(total[-1])
+    summary["max_drawdown"] = max_drawdown(total)
+    return summary
+
+
+def run_backtest(filename : Path, trader_spec : str, verbose : bool = False) -> Dict:
+    """
+    Simulates a fresh instance of trader_spec over one prices csv.
+    """
+    replay = load_replay(filename)
+    trader = load_trader_class(trader_spec)()
+
+    with trader_output(verbose):
+        profit_and_loss, _ = simulate(trader, replay, progress=False)
+
+    return {"day": str(filename), "strategy": trader_spec, **summarize(profit_and_loss)}
+
+
+def run_all(filenames : List[Path], trader_specs : List[str], workers : int = None, verbose : bool = False) -> pd.DataFrame:
+
+    # Fail fast on typos instead of inside every worker
+    for spec in trader_specs:
+        load_trader_class(spec)
+
+    # Build the stores up front, the workers only read them
+    for filename in filenames:
+        store.ensure(filename)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(run_backtest, filename, spec, verbose)
+            for filename in filenames
+            for spec in trader_specs
+        ]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            results.append(future.result())
+
+    return pd.DataFrame(results).sort_values(["strategy", "day"]).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prices", type=Path, nargs="+", required=True)
+    parser.add_argument("--traders", type=str, nargs="+", default=["trader.Trader"])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out_file", type=Path, default=None)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    summary = run_all(args.prices, args.traders, args.workers, args.verbose)
+    print(summary.to_string(index=False))
+
+    # Total profit of every strategy on every day
+    print()
+    print(summary.pivot(index="strategy", columns="day", values="total").assign(
+        total=lambda table: table.sum(axis=1)
+    ).to_string())
+
+    if args.out_file is not None:
+        summary.to_csv(args.out_file, sep=";", index=False)
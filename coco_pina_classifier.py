@@ -1,8 +1,14 @@
-from statistics import mean, median
+from collections import deque
 import numpy as np
 import pandas as pd
-from typing import Dict, List
+from typing import Dict
 import matplotlib.pyplot as plt
+from datamodel import TradingState
+from hedge import rolling_hedge
+from orderbook import MidPriceCache
+from store import load_frame
+
+BETA_WINDOW = 1000
 
 class CocoPinaCls:
     def __init__(self):
@@ -14,53 +20,41 @@ class CocoPinaCls:
         
         self.lag = 5
         self.slope_lag = 5
-        self.spreads = []
         self.time = 0
+
+        # Only the last max(lag, slope_lag) ticks are ever looked at
+        history = max(self.lag, self.slope_lag)
+        self.coco_mids = deque(maxlen=history)
+        self.spreads = deque(maxlen=history)
+        self.mid_prices = MidPriceCache()
+        self.decision_timestamp = None
+        self.decision = None
         
-    def __call__(self, states : List[Dict]):
-        pina_state = states[-1]
-        
-        if self.time >= self.lag:
-            coco_state = states[-1 - self.lag] 
-        else:
-            coco_state = pina_state
-        
-        coco_depths = coco_state.order_depths
-        # calculate mid price of COCONUTS
-        orders_coco = coco_depths['COCONUTS']
-        coco_buys = orders_coco.buy_orders
-        buys = []
-        for buy_price in coco_buys.keys():
-            buys += [buy_price] * coco_buys[buy_price]
-        median_price_buys = median(buys)
-        coco_sells = orders_coco.sell_orders
-        sells = []
-        for sell_price in coco_sells.keys():
-            sells += [sell_price] * (-coco_sells[sell_price])
-        median_price_sells = median(sells)
-        coco = mean([median_price_buys, median_price_sells])
+    def __call__(self, state : TradingState):
+        if state.timestamp == self.decision_timestamp:
+            return dict(self.decision)
         
-        pina_depths = pina_state.order_depths
-        # calculate mid price of PINA_COLADAS
-        orders_pina = pina_depths['PINA_COLADAS']
-        pina_buys = orders_pina.buy_orders
-        buys = []
-        for buy_price in pina_buys.keys():
-            buys += [buy_price] * pina_buys[buy_price]
-        median_price_buys = median(buys)
-        pina_sells = orders_pina.sell_orders
-        sells = []
-        for sell_price in pina_sells.keys():
-            sells += [sell_price] * (-pina_sells[sell_price])
-        median_price_sells = median(sells)
-        pina = mean([median_price_buys, median_price_sells])
+        # calculate mid prices of COCONUTS and PINA_COLADAS, each is computed once per tick
+        coco = self.mid_prices(state.timestamp, 'COCONUTS', state.order_depths['COCONUTS'])
+        pina = self.mid_prices(state.timestamp, 'PINA_COLADAS', state.order_depths['PINA_COLADAS'])
+
+        # PINA_COLADAS lead, compare them to the COCONUTS of lag ticks ago
+        lagged_coco = coco
+        if self.time >= self.lag and 0 < self.lag <= len(self.coco_mids):
+            lagged_coco = self.coco_mids[-self.lag]
+        self.coco_mids.append(coco)
         
         # calculate spread
-        spread = coco - self.beta * pina
-        if self.spreads == [] or self.spreads[-1] != spread:
+        spread = lagged_coco - self.beta * pina
+        if len(self.spreads) == 0 or self.spreads[-1] != spread:
             self.spreads.append(spread)
             self.time += 1
-            
+
+        self.decision_timestamp = state.timestamp
+        self.decision = self.decide(spread)
+        return dict(self.decision)
+
+    def decide(self, spread : float) -> Dict[str, int]:
         if self.time >= 30 and self.time % 5 == 0 and spread < 0 and spread - self.spreads[-5] < 0:
             return {'COCONUTS': -300, 'PINA_COLADAS': 0}
         elif self.time >= 30 and self.time % 5 == 0 and spread > 0 and spread - self.spreads[-5] > 0:
@@ -80,11 +74,11 @@ class CocoPinaCls:
                 return {'COCONUTS': -50, 'PINA_COLADAS': 5}
       
 if __name__ == "__main__":
-    data_neg1 = pd.read_csv('data/prices_round_2_day_-1.csv', sep=';')
-    data_0 = pd.read_csv('data/prices_round_3_day_0.csv', sep=';')
-    data_1 = pd.read_csv('data/prices_round_3_day_1.csv', sep=';')
-    data_2 = pd.read_csv('data/prices_round_3_day_2.csv', sep=';')
-    data_3 = pd.read_csv('data/prices_round_4_day_3.csv', sep=';')
+    data_neg1 = load_frame('data/prices_round_2_day_-1.csv')
+    data_0 = load_frame('data/prices_round_3_day_0.csv')
+    data_1 = load_frame('data/prices_round_3_day_1.csv')
+    data_2 = load_frame('data/prices_round_3_day_2.csv')
+    data_3 = load_frame('data/prices_round_4_day_3.csv')
     
     data = pd.concat([data_neg1, data_0, data_1, data_2, data_3])
     data_coco = data[data['product'] == 'COCONUTS']['mid_price'].to_numpy()
@@ -94,10 +88,16 @@ if __name__ == "__main__":
     plt.plot(data_pina)
     plt.show()
     
-    beta, _, _, _ = np.linalg.lstsq(data_pina[5:, np.newaxis], data_coco[:-5])
-    print(beta[0])
+    # Hedge ratio of the COCONUTS on the PINA_COLADAS 5 ticks later, over all days and rolling
+    beta, _ = rolling_hedge(data_pina[5:], data_coco[:-5], len(data_coco) - 5)
+    print(beta[-1])
+    rolling_beta, zscore = rolling_hedge(data_pina[5:], data_coco[:-5], BETA_WINDOW)
+    print(f"rolling beta over {BETA_WINDOW} ticks: min {np.nanmin(rolling_beta)}, max {np.nanmax(rolling_beta)}")
     
-    plt.plot(data_coco - beta[0] * data_pina)
+    plt.plot(data_coco - beta[-1] * data_pina)
+    plt.show()
+
+    plt.plot(rolling_beta)
     plt.show()
     
     
\ No newline at end of file
@@ -1,4 +1,5 @@
-import json
+from array import array
+from collections.abc import Mapping
 from typing import Dict, List
 from json import JSONEncoder
 
@@ -11,6 +12,8 @@ Observation = int
 
 
 class Listing:
+    __slots__ = ("symbol", "product", "denomination")
+
     def __init__(self, symbol: Symbol, product: Product, denomination: Product):
         self.symbol = symbol
         self.product = product
@@ -18,6 +21,8 @@ class Listing:
 
 
 class Order:
+    __slots__ = ("symbol", "price", "quantity")
+
     def __init__(self, symbol: Symbol, price: int, quantity: int) -> None:
         self.symbol = symbol
         self.price = price
@@ -28,15 +33,58 @@ class Order:
 
     def __repr__(self) -> str:
         return "(" + self.symbol + ", " + str(self.price) + ", " + str(self.quantity) + ")"
-    
+
 
 class OrderDepth:
+    __slots__ = ("buy_orders", "sell_orders")
+
     def __init__(self):
         self.buy_orders: Dict[int, int] = {}
         self.sell_orders: Dict[int, int] = {}
 
 
+class Levels(Mapping):
+    """
+    Read-only price -> volume dict over the parallel price and volume arrays of one side of
+    a PackedOrderDepth. Books have a handful of levels, so lookups scan the prices.
+    """
+    __slots__ = ("prices", "volumes")
+
+    def __init__(self, prices: array, volumes: array):
+        self.prices = prices
+        self.volumes = volumes
+
+    def __getitem__(self, price: int) -> int:
+        for i, level_price in enumerate(self.prices):
+            if level_price == price:
+                return self.volumes[i]
+        raise KeyError(price)
+
+    def __iter__(self):
+        return iter(self.prices)
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def __repr__(self) -> str:
+        return repr(dict(zip(self.prices, self.volumes)))
+
+
+class PackedOrderDepth:
+    """
+    OrderDepth stored as small int arrays, best level first, exposing the same buy_orders and
+    sell_orders dict interface. Built by the simulators, never mutated by traders.
+    """
+    __slots__ = ("buy_orders", "sell_orders")
+
+    def __init__(self, bid_prices: List[int], bid_volumes: List[int], ask_prices: List[int], ask_volumes: List[int]):
+        self.buy_orders = Levels(array("q", bid_prices), array("q", bid_volumes))
+        self.sell_orders = Levels(array("q", ask_prices), array("q", ask_volumes))
+
+
 class Trade:
+    __slots__ = ("symbol", "price", "quantity", "buyer", "seller", "timestamp")
+
     def __init__(self, symbol: Symbol, price: int, quantity: int, buyer: UserId = None, seller: UserId = None, timestamp: int = 0) -> None:
         self.symbol = symbol
         self.price: int = price
@@ -46,6 +94,8 @@ class Trade:
         self.timestamp = timestamp
 
 class TradingState(object):
+    __slots__ = ("timestamp", "listings", "order_depths", "own_trades", "market_trades", "position", "observations")
+
     def __init__(self,
                  timestamp: Time,
                  listings: Dict[Symbol, Listing],
@@ -61,10 +111,45 @@ class TradingState(object):
         self.market_trades = market_trades
         self.position = position
         self.observations = observations
-        
+
     def toJSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True)
-    
+        # Same output as the old json.dumps(self, default=lambda o: o.__dict__, sort_keys=True),
+        # the fields are walked explicitly instead of reflected and the C encoder does the rest
+        return _state_encoder.encode({
+            "listings": {symbol: _listing_fields(listing) for symbol, listing in self.listings.items()},
+            "market_trades": {symbol: [_trade_fields(trade) for trade in trades] for symbol, trades in self.market_trades.items()},
+            "observations": self.observations,
+            "order_depths": {symbol: _order_depth_fields(order_depth) for symbol, order_depth in self.order_depths.items()},
+            "own_trades": {symbol: [_trade_fields(trade) for trade in trades] for symbol, trades in self.own_trades.items()},
+            "position": self.position,
+            "timestamp": self.timestamp
+        })
+
+
+_state_encoder = JSONEncoder(sort_keys=True)
+
+
+def _listing_fields(listing: Listing) -> Dict:
+    return {"denomination": listing.denomination, "product": listing.product, "symbol": listing.symbol}
+
+
+def _levels_fields(levels) -> Dict[int, int]:
+    return dict(zip(levels.prices, levels.volumes)) if isinstance(levels, Levels) else levels
+
+
+def _order_depth_fields(order_depth: OrderDepth) -> Dict:
+    return {"buy_orders": _levels_fields(order_depth.buy_orders), "sell_orders": _levels_fields(order_depth.sell_orders)}
+
+
+def _trade_fields(trade: Trade) -> Dict:
+    return {
+        "buyer": trade.buyer, "price": trade.price, "quantity": trade.quantity,
+        "seller": trade.seller, "symbol": trade.symbol, "timestamp": trade.timestamp
+    }
+
+
 class ProsperityEncoder(JSONEncoder):
         def default(self, o):
-            return o.__dict__
\ No newline at end of file
+            if isinstance(o, Mapping):
+                return dict(o)
+            return {name: getattr(o, name) for name in o.__slots__}
@@ -1,89 +1,86 @@
 from typing import Callable, Dict, List
+from collections import deque
 from copy import deepcopy
 import numpy as np
-from statistics import mean, median
 from datamodel import OrderDepth, TradingState, Order
+from orderbook import MidPriceCache
 
 class CocoPinaCls:
-    def __init__(self):
+    def __init__(self, beta=0.5331881677582299, lag=5, slope_lag=5, threshold=20, warmup=30,
+                 small_size=5, large_size=10, exit_size=300, small_coco_sell_size=50):
         self.limits = {
           "COCONUTS": 600,
           "PINA_COLADAS": 300
         }
-        self.beta = 0.5331881677582299
+        self.beta = beta
         
-        self.lag = 5
-        self.slope_lag = 5
-        self.spreads = []
+        self.lag = lag
+        self.slope_lag = slope_lag
         self.time = 0
+
+        # Only the last max(lag, slope_lag) ticks are ever looked at
+        history = max(lag, slope_lag)
+        self.coco_mids = deque(maxlen=history)
+        self.spreads = deque(maxlen=history)
+        self.mid_prices = MidPriceCache()
+        self.decision_timestamp = None
+        self.decision = None
+
+        # spread above which we go BOLD, ticks before the slope exits and order sizes
+        self.threshold = threshold
+        self.warmup = warmup
+        self.small_size = small_size
+        self.large_size = large_size
+        self.exit_size = exit_size
+        self.small_coco_sell_size = small_coco_sell_size
         
-    def __call__(self, states : List[Dict]):
-        pina_state = states[-1]
-        
-        if self.time >= self.lag:
-            coco_state = states[-1 - self.lag] 
-        else:
-            coco_state = pina_state
-        
-        coco_depths = coco_state.order_depths
-        # calculate mid price of COCONUTS
-        orders_coco = coco_depths['COCONUTS']
-        coco_buys = orders_coco.buy_orders
-        buys = []
-        for buy_price in coco_buys.keys():
-            buys += [buy_price] * coco_buys[buy_price]
-        median_price_buys = median(buys)
-        coco_sells = orders_coco.sell_orders
-        sells = []
-        for sell_price in coco_sells.keys():
-            sells += [sell_price] * (-coco_sells[sell_price])
-        median_price_sells = median(sells)
-        coco = mean([median_price_buys, median_price_sells])
+    def __call__(self, state : TradingState):
+        if state.timestamp == self.decision_timestamp:
+            return dict(self.decision)
         
-        pina_depths = pina_state.order_depths
-        # calculate mid price of PINA_COLADAS
-        orders_pina = pina_depths['PINA_COLADAS']
-        pina_buys = orders_pina.buy_orders
-        buys = []
-        for buy_price in pina_buys.keys():
-            buys += [buy_price] * pina_buys[buy_price]
-        median_price_buys = median(buys)
-        pina_sells = orders_pina.sell_orders
-        sells = []
-        for sell_price in pina_sells.keys():
-            sells += [sell_price] * (-pina_sells[sell_price])
-        median_price_sells = median(sells)
-        pina = mean([median_price_buys, median_price_sells])
+        # calculate mid prices of COCONUTS and PINA_COLADAS, each is computed once per tick
+        coco = self.mid_prices(state.timestamp, 'COCONUTS', state.order_depths['COCONUTS'])
+        pina = self.mid_prices(state.timestamp, 'PINA_COLADAS', state.order_depths['PINA_COLADAS'])
+
+        # PINA_COLADAS lead, compare them to the COCONUTS of lag ticks ago
+        lagged_coco = coco
+        if self.time >= self.lag and 0 < self.lag <= len(self.coco_mids):
+            lagged_coco = self.coco_mids[-self.lag]
+        self.coco_mids.append(coco)
         
         # calculate spread
-        spread = coco - self.beta * pina
-        if self.spreads == [] or self.spreads[-1] != spread:
+        spread = lagged_coco - self.beta * pina
+        if len(self.spreads) == 0 or self.spreads[-1] != spread:
             self.spreads.append(spread)
             self.time += 1
-            
-        if self.time >= 30 and self.time % 5 == 0 and spread < 0 and spread - self.spreads[-5] < 0:
-            return {'COCONUTS': -300, 'PINA_COLADAS': 0}
-        elif self.time >= 30 and self.time % 5 == 0 and spread > 0 and spread - self.spreads[-5] > 0:
-            return {'COCONUTS': 0, 'PINA_COLADAS': -300}
+
+        self.decision_timestamp = state.timestamp
+        self.decision = self.decide(spread)
+        return dict(self.decision)
+
+    def decide(self, spread : float) -> Dict[str, int]:
+        if self.time >= self.warmup and self.time % self.slope_lag == 0 and spread < 0 and spread - self.spreads[-self.slope_lag] < 0:
+            return {'COCONUTS': -self.exit_size, 'PINA_COLADAS': 0}
+        elif self.time >= self.warmup and self.time % self.slope_lag == 0 and spread > 0 and spread - self.spreads[-self.slope_lag] > 0:
+            return {'COCONUTS': 0, 'PINA_COLADAS': -self.exit_size}
         
         # if spread is negative, PINA_COLADAS are overpriced, otherwise COCONUTS are
         if spread < 0:
             # long cocos, short pinas, go BOLD
-            if abs(spread) > 20:
-                return {'COCONUTS': 10, 'PINA_COLADAS': -10}
+            if abs(spread) > self.threshold:
+                return {'COCONUTS': self.large_size, 'PINA_COLADAS': -self.large_size}
             else:
-                return {'COCONUTS': 5, 'PINA_COLADAS': -5}
+                return {'COCONUTS': self.small_size, 'PINA_COLADAS': -self.small_size}
         else:
-            if abs(spread) > 20:
-                return {'COCONUTS': -10, 'PINA_COLADAS': 10}
+            if abs(spread) > self.threshold:
+                return {'COCONUTS': -self.large_size, 'PINA_COLADAS': self.large_size}
             else:
-                return {'COCONUTS': -50, 'PINA_COLADAS': 5}
+                return {'COCONUTS': -self.small_coco_sell_size, 'PINA_COLADAS': self.small_size}
 
 class Trader:
 
-    def __init__(self, verbose = False):
+    def __init__(self, verbose = False, coco_pina_params : Dict = None):
         self.time : int = 0
-        self.states : List[Dict] = []
         self.limits = {
             "PEARLS": 20,
             "BANANAS": 20,
@@ -95,6 +92,8 @@ class Trader:
         }
         self.hard_limit = False
         self.verbose = verbose
+        self.coco_pina_params = coco_pina_params or {}
+        self.coco_pina_cls = CocoPinaCls(**self.coco_pina_params)
 
 
     def run(self, state: TradingState) -> Dict[str, List[Order]]:
@@ -111,14 +110,12 @@ class Trader:
 
         self.add_state(state)
         
-        coco_pina_cls = CocoPinaCls()
-        
         # Iterate over all the keys (the available products) contained in the order depths
         result = {}
         for product in state.order_depths.keys():
             
             if product == 'COCONUTS' or product == 'PINA_COLADAS':
-                diffs = coco_pina_cls(self.states)
+                diffs = self.coco_pina_cls(state)
             else:
                 diffs = None
 
@@ -150,8 +147,7 @@ class Trader:
 
     
     def add_state(self, state: TradingState):
-        self.states.append(state)
-
+        # The state is not kept, the classifier holds the history it needs
         if self.verbose:
             print(state.toJSON())
 
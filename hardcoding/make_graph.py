@@ -1,9 +1,20 @@
-from math import isnan
-import matplotlib.pyplot as plt
-import networkx as nx
+import argparse
+import json
+import sys
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from numpy.lib.stride_tricks import sliding_window_view
 from pathlib import Path
+from typing import Dict, List, Tuple, Union
+from tqdm.auto import tqdm
+
+# The market data store and the traders live at the root of the repository
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from store import ensure, load_frame, write_atomic
+from trader import POSITION_LIMITS
+
+CACHE_DIR = Path(__file__).resolve().parent / ".cache"
 
 class StockmarketLog:
 
@@ -12,13 +23,14 @@ class StockmarketLog:
     ask_price_token : str = "ask_price_"
     ask_volume_token : str = "ask_volume_"
 
-    def __init__(self, filename : Path, max_pos : int):
+    def __init__(self, filename : Path, max_pos : Union[int, Dict[str, int]], products : List[str] = None):
 
-        # Set params
-        self.max_pos = max_pos
+        # Set params, max_pos is either one limit for all products or a limit per product
+        self.limits = max_pos if isinstance(max_pos, dict) else None
+        self.max_pos = None if isinstance(max_pos, dict) else max_pos
 
         # Load data
-        df = pd.read_csv(filename, sep=";")
+        df = load_frame(filename)
 
         # Query number of biders and askers
         # Set number of bots
@@ -33,108 +45,149 @@ class StockmarketLog:
         assert nbiders == naskers
         self.nbots = nbiders
 
-        # Make 
-        self.optimal_positions = {
-          k: self.make_graph(table, k)
-          for k, table in df.groupby("product")
-        }      
-
-    def make_graph(self, table : pd.DataFrame, key : str):
-        graph = nx.DiGraph()
-
+        # Solve every product, or the ones asked for
+        self.optimal_positions, self.totals = {}, {}
+        for k, table in df.groupby("product"):
+            if products is None or k in products:
+                if self.limits is not None:
+                    self.max_pos = self.limits[k]
+                self.optimal_positions[k], self.totals[k] = self.solve(table, k)
+
+    def solve(self, table : pd.DataFrame, key : str) -> Tuple[List[int], float]:
+        """
+        Hindsight optimal positions of one product, from 0 before the first tick back to 0 after
+        the last one. A shortest path DP over the vector of the 2 * max_pos + 1 positions: each
+        tick every position is reached by staying, buying up its cumulative ask cost curve or
+        selling down its cumulative bid curve, keeping the cheapest, with a backpointer to the
+        position it came from.
+        """
+        npos = 2 * self.max_pos + 1
         t_end = table.shape[0]
-        for t in range(t_end + 1):
-            self.add_layer(graph, t)
-        for t in range(t_end):
-            self.add_edges(graph, table, t)
-
-        # p = nx.shortest_path(graph, source="0_0",target=f"{t_end}_0", weight="weight")
-        p = nx.bellman_ford_path(graph, source="0_0",target=f"{t_end}_0", weight="weight")
-
-        path = [
-          int(pos.split("_")[-1])
-          for pos in p
-        ]
-
-        cost = nx.get_edge_attributes(graph,'cost')
-        total = 0
-        for prev, curr in zip(p[:-1], p[1:]):
-            total += cost[(prev, curr)]
-        print(total)
-        
-        # plt.figure(3,figsize=(60,12)) 
-
-        # edges = graph.edges()
-        # special = [(u, v) for u, v in zip(p[:-1], p[1:])]
-        # colors = [("red" if (u, v) in special else "black") for u,v in edges]
-
-        # pos=nx.get_node_attributes(graph,'pos')
-        # labels = nx.get_edge_attributes(graph,'cost')
-        # nx.draw(graph, pos, node_size=150, node_color='blue', font_size=6, font_weight='bold', edge_color=colors)
-        # nx.draw_networkx_edge_labels(graph,pos,edge_labels=labels, label_pos=0.25)
-        # plt.savefig(f"Graph_{key}.png", format="PNG")
-
-        return path
-
-    
-    def add_layer(self, graph : nx.DiGraph, t : int):
-        for i in range(-self.max_pos, self.max_pos + 1):
-            graph.add_node(f"{t}_{i}", pos=(t,i))
-
+        bid_prices, bid_volumes = self.get_levels(StockmarketLog.bid_price_token, StockmarketLog.bid_volume_token, table)
+        ask_prices, ask_volumes = self.get_levels(StockmarketLog.ask_price_token, StockmarketLog.ask_volume_token, table)
 
-    def add_edges(self, graph : nx.DiGraph, table : pd.DataFrame, t : int):
-        
-        line = table.iloc[t]
-        bids = self.get_positions(StockmarketLog.bid_price_token, StockmarketLog.bid_volume_token, line)
-        bids.sort(reverse=True)
-        bids_cum = np.cumsum(bids).tolist()
+        # cost[i] is the cheapest cost of holding position i - max_pos, back[t, i] the position before tick t
+        positions = np.arange(npos)
+        cost = np.full(npos, np.inf)
+        cost[self.max_pos] = 0.0
+        back = np.empty((t_end, npos), dtype=np.int32)
 
-        asks = self.get_positions(StockmarketLog.ask_price_token, StockmarketLog.ask_volume_token, line)
-        asks.sort()
-        asks_cum = np.cumsum(asks).tolist()
-
-        # Add edges for each node
-        for i in range(-self.max_pos, self.max_pos + 1):
-            self.add_edges_from_node(graph, i, t, bids_cum, asks_cum)
-
-
-    def get_positions(self, price_token : str, volume_token : str, line : pd.DataFrame):
-
-        # Represents positions as list of floats
-        positions = []
-
-        # Add position from all bots
-        for bot in range(1, self.nbots + 1):
-            bid_price = line[price_token + str(bot)]
-            bid_volume = line[volume_token + str(bot)]
-
-            if not isnan(bid_price) and not isnan(bid_volume):
-                positions.extend([float(bid_price)] * int(bid_volume))
-
-        return positions
-
-
-    def add_edges_from_node(self, graph : nx.DiGraph, i : int, t : int, bids_cum : list, asks_cum : list):
-
-        graph.add_edge(f"{t}_{i}", f"{t + 1}_{i}", weight=0.0, cost=0.0)
-
-        for delta, j in enumerate(range(i + 1, self.max_pos + 1)[:len(asks_cum)]):
-            graph.add_edge(
-                f"{t}_{i}", f"{t + 1}_{j}", 
-                weight=asks_cum[delta],
-                cost=-asks_cum[delta]
-            )
+        for t in range(t_end):
+            bids_cum = self.cost_curve(bid_prices[t], bid_volumes[t], reverse=True)
+            asks_cum = self.cost_curve(ask_prices[t], ask_volumes[t], reverse=False)
+
+            # Staying is free and wins ties, then the smallest trade does
+            new_cost, prev = cost.copy(), positions.copy()
+            for curve, side in [(asks_cum, 1), (-bids_cum, -1)]:
+                if len(curve) == 0:
+                    continue
+
+                # Row d of the windows holds, for every position i, the cost of position i - side * (d + 1)
+                ntrades = len(curve)
+                padding = np.full(ntrades, np.inf)
+                if side > 0:
+                    windows = sliding_window_view(np.concatenate([padding, cost]), npos)[ntrades - 1::-1]
+                else:
+                    windows = sliding_window_view(np.concatenate([cost, padding]), npos)[1:]
+                candidates = windows + curve[:, np.newaxis]
+
+                best = np.argmin(candidates, axis=0)
+                best_cost = candidates[best, positions]
+                better = best_cost < new_cost
+                new_cost = np.where(better, best_cost, new_cost)
+                prev = np.where(better, positions - side * (best + 1), prev)
+
+            cost = new_cost
+            back[t] = prev
+
+        # Walk the backpointers from position 0 after the last tick
+        path = [self.max_pos]
+        for t in range(t_end - 1, -1, -1):
+            path.append(int(back[t, path[-1]]))
+        path = [i - self.max_pos for i in path[::-1]]
+
+        total = 0.0 - cost[self.max_pos]
+        return path, total
+
+
+    def get_levels(self, price_token : str, volume_token : str, table : pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        # Prices and volumes of all bots, one row per tick
+        prices = np.stack([table[price_token + str(bot)].to_numpy(dtype=float) for bot in range(1, self.nbots + 1)], axis=1)
+        volumes = np.stack([table[volume_token + str(bot)].to_numpy(dtype=float) for bot in range(1, self.nbots + 1)], axis=1)
+        return prices, volumes
+
+
+    def cost_curve(self, prices : np.ndarray, volumes : np.ndarray, reverse : bool) -> np.ndarray:
+        """
+        Cumulative price of trading 1, 2, ... units against the levels of one tick, best unit
+        first. Levels with a nan price or volume are skipped, as are more units than can ever
+        be traded within the position limits.
+        """
+        valid = ~np.isnan(prices) & ~np.isnan(volumes)
+        units = np.repeat(prices[valid], np.maximum(volumes[valid].astype(int), 0))
+        units.sort()
+        if reverse:
+            units = units[::-1]
+        return np.cumsum(units[:2 * self.max_pos])
+
+
+def solve_cached(filename : Path, sha1 : str, product : str, max_pos : int, cache_dir : Path) -> Tuple[np.ndarray, float]:
+    """
+    Optimal positions and total of one product of one csv, cached on disk under the hash of
+    the csv and the position limit, so that a day is only ever solved once per limit.
+    """
+    path = cache_dir / f"{sha1}.{product}.{max_pos}.npz"
+    if path.exists():
+        with np.load(path) as cached:
+            return cached["positions"], float(cached["total"])
+
+    log = StockmarketLog(filename, max_pos, [product])
+    positions, total = np.array(log.optimal_positions[product], dtype=np.int32), log.totals[product]
+    write_atomic(path, lambda file: np.savez(file, positions=positions, total=total))
+    return positions, total
+
+
+def solve_all(filenames : List[Path], limits : Dict[str, int], cache_dir : Path = CACHE_DIR, workers : int = None) -> Dict[str, Dict[str, Tuple[np.ndarray, float]]]:
+    """
+    Solves every (file, product) with a position limit in its own process. Products without a
+    limit, such as DOLPHIN_SIGHTINGS, cannot be traded and are skipped.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # Build the stores up front, the workers only read them. Their meta holds the hash of the csv
+    tasks = []
+    for filename in filenames:
+        meta = ensure(filename)
+        tasks += [(filename, meta["sha1"], product, limits[product]) for product in meta["categories"]["product"] if product in limits]
+
+    results = {str(filename): {} for filename in filenames}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(solve_cached, filename, sha1, product, max_pos, cache_dir): (filename, product) for filename, sha1, product, max_pos in tasks}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            filename, product = futures[future]
+            results[str(filename)][product] = future.result()
+    return results
 
-        for delta, j in enumerate(range(i - 1, -self.max_pos - 1, -1)[:len(bids_cum)]):
-            graph.add_edge(
-                f"{t}_{i}", f"{t + 1}_{j}", 
-                weight=-bids_cum[delta],
-                cost=bids_cum[delta]
-            )
 
-import json
 if __name__ == "__main__":
-    json.dump(
-        StockmarketLog("1370d8be-d8f3-4142-8ac8-6cbcd8b3661b.csv", 20).optimal_positions,
-        open("trades.json", "w")
-    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prices", type=Path, nargs="+", required=True)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache_dir", type=Path, default=CACHE_DIR)
+    parser.add_argument("--out_file", type=Path, default=None, help="json of the optimal positions per file and product")
+    args = parser.parse_args()
+
+    results = solve_all(args.prices, POSITION_LIMITS, args.cache_dir, args.workers)
+
+    # Upper bound on the profit of any strategy with the same position limits
+    for filename, products in results.items():
+        for product, (_, total) in sorted(products.items()):
+            print(f"{filename}\t{product}\t{total:.1f}")
+        print(f"{filename}\ttotal\t{sum(total for _, total in products.values()):.1f}")
+
+    if args.out_file is not None:
+        json.dump(
+            {filename: {product: positions.tolist() for product, (positions, _) in products.items()} for filename, products in results.items()},
+            open(args.out_file, "w")
+        )
@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import sys
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+from backtest import load_trader_class, trader_output
+from datamodel import Listing, Order, Trade, TradingState
+from ledger import LotLedger
+from matching import MatchingEngine
+from replay import MarketReplay
+from simulator import CURRENCY, commodities, position_limits, replay_products
+from store import load_replay
+
+# Time the exchange gives Trader.run per tick, the Lambda durations of the sandbox logs
+DEADLINE_MS = 7.0
+
+
+class StandInExchange:
+    """
+    Local stand-in for the exchange. Hands out the TradingState of each tick of a replay and
+    books the orders it gets back, like simulate does.
+    """
+
+    def __init__(self, replay : MarketReplay):
+        self.replay = replay
+        self.listings = {c: Listing(c, c, CURRENCY) for c in commodities}
+        self.position = {c: 0 for c in commodities}
+        self.pending_trades = {c: [] for c in commodities}
+        self.ledgers = {c: LotLedger() for c in commodities}
+        self.profit = {c: 0 for c in commodities}
+        self.engine = MatchingEngine(position_limits)
+
+    def states(self):
+        for t, (timestamp, order_depths) in enumerate(self.replay):
+            # Own trades booked since the last state, the previous tick only, as the exchange sends them
+            own_trades, self.pending_trades = self.pending_trades, {c: [] for c in commodities}
+            yield TradingState(timestamp, self.listings, order_depths, own_trades, {}, dict(self.position), self.replay.observations(t))
+
+    def submit(self, state : TradingState, orders : Dict[str, List[Order]]):
+        for c in commodities:
+            if c not in orders:
+                continue
+            for price, quantity in self.engine.match(state.timestamp, c, orders[c], state.order_depths.get(c), self.position[c]):
+                self.pending_trades[c].append(Trade(c, price, abs(quantity), None, None, state.timestamp))
+                self.profit[c] += self.ledgers[c].fill(price, quantity)
+                self.position[c] = self.ledgers[c].position
+
+
+class Harness:
+    """
+    Drives a trader from the exchange on a clock of one tick every interval_ms, 0 to go as
+    fast as the trader allows. Each run call gets deadline_ms from the moment its tick is sent.
+    Like on the exchange, a late or failed response places no orders.
+
+    The trader runs on a single worker thread, as its state is not safe to share. A call that
+    overruns keeps the worker busy, so the next tick waits for it and eats into its own budget.
+    """
+
+    def __init__(self, trader, exchange : StandInExchange, deadline_ms : float, interval_ms : float = 0.0):
+        self.trader = trader
+        self.exchange = exchange
+        self.deadline_ms = deadline_ms
+        self.interval_ms = interval_ms
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.latencies : List[float] = []
+        self.missed : List[int] = []
+        self.failed : List[int] = []
+
+    def call(self, state : TradingState, sent : float):
+        # Runs on the worker thread, the latency counts from the moment the tick was sent
+        try:
+            return self.trader.run(state)
+        finally:
+            self.latencies.append((time.perf_counter() - sent) * 1000)
+
+    def miss(self, state : TradingState):
+        self.missed.append(state.timestamp)
+        print(f"{state.timestamp} missed the {self.deadline_ms:g} ms deadline, no orders", file=sys.stderr)
+
+    async def tick(self, state : TradingState):
+        loop = asyncio.get_running_loop()
+        sent = time.perf_counter()
+        future = loop.run_in_executor(self.executor, self.call, state, sent)
+        try:
+            orders = await asyncio.wait_for(asyncio.shield(future), self.deadline_ms / 1000)
+        except asyncio.TimeoutError:
+            # The call still finishes on the worker, only its answer is dropped
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self.miss(state)
+            return
+        except Exception as error:
+            self.failed.append(state.timestamp)
+            print(f"{state.timestamp} failed, no orders: {error!r}", file=sys.stderr)
+            return
+
+        # The loop can see the answer in the same iteration as an expired timeout, trust the clock
+        if self.latencies[-1] > self.deadline_ms:
+            self.miss(state)
+            return
+        self.exchange.submit(state, orders)
+
+    async def run(self):
+        start = time.perf_counter()
+        for k, state in enumerate(self.exchange.states()):
+            if self.interval_ms > 0:
+                await asyncio.sleep(max(0.0, start + k * self.interval_ms / 1000 - time.perf_counter()))
+            await self.tick(state)
+
+        # Let an overrunning last call finish before the report
+        await asyncio.get_running_loop().run_in_executor(self.executor, lambda: None)
+        self.executor.shutdown()
+
+    def report(self) -> str:
+        latencies = np.array(self.latencies)
+        return "\n".join([
+            f"{len(latencies)} ticks, latency p50 {np.percentile(latencies, 50):.3f} ms, "
+            f"p99 {np.percentile(latencies, 99):.3f} ms, max {latencies.max():.3f} ms",
+            f"{len(self.missed)} missed deadlines, {len(self.failed)} failed calls",
+            f"Profit {sum(self.exchange.profit.values())}: {self.exchange.profit}",
+        ])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prices", type=Path, required=True)
+    parser.add_argument("--trader", type=str, default="trader.Trader")
+    parser.add_argument("--deadline_ms", type=float, default=DEADLINE_MS)
+    parser.add_argument("--interval_ms", type=float, default=0.0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    harness = Harness(load_trader_class(args.trader)(), StandInExchange(load_replay(args.prices, replay_products)),
+                      args.deadline_ms, args.interval_ms)
+
+    with trader_output(args.verbose):
+        asyncio.run(harness.run())
+
+    print(harness.report())
@@ -0,0 +1,75 @@
+from collections import deque
+from typing import Tuple
+import numpy as np
+
+
+class RollingHedge:
+    """
+    Hedge ratio of y on x, a regression through the origin like the offline lstsq, over the
+    last window pairs. Keeps the sums of x, y, xy, x² and y² so every update is O(1), and
+    from them the mean and deviation of the residuals y - beta * x for the spread z-score.
+    """
+
+    def __init__(self, window : int):
+        self.window = window
+        self.pairs = deque()
+        self.sx = self.sy = self.sxy = self.sxx = self.syy = 0.0
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def full(self) -> bool:
+        return len(self.pairs) >= self.window
+
+    def update(self, x : float, y : float):
+        self.pairs.append((x, y))
+        self.add(x, y, 1)
+        if len(self.pairs) > self.window:
+            self.add(*self.pairs.popleft(), -1)
+
+    def add(self, x : float, y : float, sign : int):
+        self.sx += sign * x
+        self.sy += sign * y
+        self.sxy += sign * x * y
+        self.sxx += sign * x * x
+        self.syy += sign * y * y
+
+    @property
+    def beta(self) -> float:
+        return self.sxy / self.sxx if self.sxx > 0 else np.nan
+
+    def residuals(self) -> Tuple[float, float]:
+        # Mean and standard deviation of y - beta * x over the window
+        n, beta = len(self.pairs), self.beta
+        if n == 0 or np.isnan(beta):
+            return np.nan, np.nan
+        mean = (self.sy - beta * self.sx) / n
+        variance = (self.syy - 2 * beta * self.sxy + beta * beta * self.sxx) / n - mean * mean
+        return mean, np.sqrt(max(variance, 0.0))
+
+    def zscore(self, x : float, y : float) -> float:
+        mean, std = self.residuals()
+        return (y - self.beta * x - mean) / std if std > 0 else np.nan
+
+
+def rolling_hedge(x : np.ndarray, y : np.ndarray, window : int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Batch version of RollingHedge over whole series, from windowed differences of cumulative
+    sums. Returns beta and the z-score of every pair against the window that ends on it, nan
+    until window pairs were seen, so element t is what RollingHedge has after update t.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+
+    def windowed(values : np.ndarray) -> np.ndarray:
+        cumulative = np.concatenate([[0.0], np.cumsum(values)])
+        sums = np.full(len(values), np.nan)
+        sums[window - 1:] = cumulative[window:] - cumulative[:-window]
+        return sums
+
+    sx, sy, sxy, sxx, syy = windowed(x), windowed(y), windowed(x * y), windowed(x * x), windowed(y * y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        beta = sxy / sxx
+        mean = (sy - beta * sx) / window
+        std = np.sqrt(np.maximum((syy - 2 * beta * sxy + beta * beta * sxx) / window - mean * mean, 0.0))
+        zscore = (y - beta * x - mean) / std
+    return beta, zscore
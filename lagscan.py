@@ -0,0 +1,85 @@
+import argparse
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import List, Tuple
+from store import load_frame
+
+PRODUCTS = ["BANANAS", "BERRIES", "DIVING_GEAR", "COCONUTS", "PINA_COLADAS", "DOLPHIN_SIGHTINGS"]
+
+
+def mid_returns(df : pd.DataFrame, products : List[str]) -> np.ndarray:
+    """
+    Tick to tick changes of the mid price of every product, one row per product. Ticks where a
+    side of the book is empty have a mid price of 0 in the csv and keep the last one instead.
+    """
+    mids = df.pivot_table(index="timestamp", columns="product", values="mid_price").reindex(columns=products)
+    mids = mids.replace(0.0, np.nan).ffill().bfill()
+    return np.diff(mids.to_numpy().T, axis=1)
+
+
+def cross_correlations(returns : np.ndarray, max_lag : int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Correlation of every pair of rows of returns for every lag in [-max_lag, max_lag], from one
+    FFT per row. corr[a, b, k] correlates row a at t with row b at t + lags[k], so a positive
+    lag means that a leads b. Each lag is normalized by the number of pairs that overlap.
+    """
+    n = returns.shape[1]
+    std = returns.std(axis=1, keepdims=True)
+    z = np.divide(returns - returns.mean(axis=1, keepdims=True), std, out=np.zeros_like(returns), where=std > 0)
+
+    # Zero padded to at least n + max_lag, so that lags up to max_lag do not wrap around
+    nfft = 1 << int(np.ceil(np.log2(n + max_lag)))
+    spectra = np.fft.rfft(z, n=nfft, axis=1)
+    cross = np.fft.irfft(spectra[:, np.newaxis, :].conj() * spectra[np.newaxis, :, :], n=nfft, axis=2)
+
+    lags = np.arange(-max_lag, max_lag + 1)
+    corr = cross[:, :, lags % nfft] / (n - np.abs(lags))
+    return lags, corr
+
+
+def best_lags(lags : np.ndarray, corr : np.ndarray, products : List[str]) -> pd.DataFrame:
+    # Lag of the strongest correlation, in absolute value, of every pair
+    rows = []
+    for a in range(len(products)):
+        for b in range(a + 1, len(products)):
+            k = np.nanargmax(np.abs(corr[a, b]))
+            rows.append({"product_a": products[a], "product_b": products[b], "lag": lags[k], "correlation": corr[a, b, k]})
+    return pd.DataFrame(rows)
+
+
+def lagscan(filenames : List[Path], products : List[str], max_lag : int) -> pd.DataFrame:
+    """
+    Best lag of every pair of products, per day and over all days. The days are pooled by
+    averaging their correlations weighted by their number of ticks.
+    """
+    results, pooled, total = [], 0.0, 0
+    for filename in filenames:
+        df = load_frame(filename)
+        returns = mid_returns(df, products)
+        lags, corr = cross_correlations(returns, max_lag)
+
+        day = df["day"].iloc[0] if "day" in df.columns else Path(filename).stem
+        results.append(best_lags(lags, corr, products).assign(day=day))
+        pooled, total = pooled + corr * returns.shape[1], total + returns.shape[1]
+
+    results.append(best_lags(lags, pooled / total, products).assign(day="all"))
+    return pd.concat(results, ignore_index=True)[["day", "product_a", "product_b", "lag", "correlation"]]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prices", type=Path, nargs="+", required=True)
+    parser.add_argument("--products", type=str, nargs="+", default=PRODUCTS)
+    parser.add_argument("--max_lag", type=int, default=50)
+    parser.add_argument("--out_file", type=Path, default=None)
+    args = parser.parse_args()
+
+    result = lagscan(args.prices, args.products, args.max_lag)
+
+    # A positive lag means that product_a leads product_b by that many ticks
+    print(result.to_string(index=False))
+
+    if args.out_file is not None:
+        result.to_csv(args.out_file, sep=";", index=False)
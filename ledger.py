@@ -0,0 +1,125 @@
+import bisect
+from collections import deque
+from typing import Deque, List
+
+
+class LotLedger:
+    """
+    FIFO inventory of one product. Fills are stored as (price, quantity) lots and the
+    cost basis of the open lots is kept as a running total, so a fill only touches the
+    lots it opens or closes instead of one list entry per unit.
+    """
+
+    def __init__(self):
+        # Open lots, oldest first. Quantities are positive, the side is given by self.position
+        self.lots : Deque[List[int]] = deque()
+        self.position : int = 0
+        self.cost : int = 0
+        self.realized : int = 0
+
+    def fill(self, price : int, quantity : int) -> int:
+        """
+        Books a fill of quantity units at price (positive to buy, negative to sell),
+        closing opposite lots first. Returns the realized profit of this fill.
+        """
+        profit = 0
+        remaining = abs(quantity)
+        side = 1 if quantity > 0 else -1
+
+        # Close positions on the opposite side first
+        while remaining > 0 and self.position * side < 0:
+            lot = self.lots[0]
+            close_quantity = min(lot[1], remaining)
+            # Long lots close at a sell (side = -1), short lots at a buy (side = 1)
+            profit += -side * close_quantity * (price - lot[0])
+            self.cost -= close_quantity * lot[0]
+            self.position += side * close_quantity
+            remaining -= close_quantity
+            if close_quantity == lot[1]:
+                self.lots.popleft()
+            else:
+                lot[1] -= close_quantity
+
+        # Open new positions with whatever is left
+        if remaining > 0:
+            self.lots.append([price, remaining])
+            self.cost += remaining * price
+            self.position += side * remaining
+
+        self.realized += profit
+        return profit
+
+    def quantity(self) -> int:
+        return abs(self.position)
+
+    def average_price(self) -> float:
+        if self.position == 0:
+            return 0
+        return self.cost / abs(self.position)
+
+    def unrealized(self, mid_price : float) -> float:
+        return self.position * mid_price - (self.cost if self.position > 0 else -self.cost)
+
+
+class LotAges:
+    """
+    Ages of the units of one side of an inventory, oldest first. Units are stored as lots of
+    (entry tick, quantity) with prefix sums of the quantities and of quantity * entry tick, so
+    an age is now - entry tick and advancing the clock touches no unit. The mean age of any
+    run of consecutive units is two bisections over the lots.
+    """
+
+    def __init__(self):
+        self.now : int = 0
+
+        # Prefix sums over the lots, units closed from the front are skipped by self.front
+        self.entries : List[int] = []
+        self.unit_ends : List[int] = [0]
+        self.tick_sums : List[int] = [0]
+        self.front : int = 0
+
+    def __len__(self) -> int:
+        return self.unit_ends[-1] - self.front
+
+    def advance(self):
+        self.now += 1
+
+    def add(self, quantity : int):
+        # Opens quantity units with an age of 0
+        if quantity <= 0:
+            return
+        self.entries.append(self.now)
+        self.unit_ends.append(self.unit_ends[-1] + quantity)
+        self.tick_sums.append(self.tick_sums[-1] + quantity * self.now)
+
+    def take(self, quantity : int):
+        # Closes the quantity oldest units
+        self.front += min(quantity, len(self))
+
+        # Drop the closed lots once they are the majority, so the lists stay as long as the open lots
+        closed = bisect.bisect_right(self.unit_ends, self.front) - 1
+        if closed > len(self.entries) // 2:
+            units, ticks = self.unit_ends[closed], self.tick_sums[closed]
+            self.entries = self.entries[closed:]
+            self.unit_ends = [end - units for end in self.unit_ends[closed:]]
+            self.tick_sums = [total - ticks for total in self.tick_sums[closed:]]
+            self.front -= units
+
+    def tick_sum(self, unit : int) -> int:
+        # Sum of the entry ticks of the units before unit, counting closed units too
+        k = bisect.bisect_right(self.unit_ends, unit) - 1
+        if k == len(self.entries):
+            return self.tick_sums[k]
+        return self.tick_sums[k] + (unit - self.unit_ends[k]) * self.entries[k]
+
+    def mean_age(self, units : slice) -> float:
+        """
+        Mean age of the open units selected by units, a slice with the semantics of a list of
+        one age per unit, oldest first: slice(None, n) for the oldest n units. nan when empty.
+        """
+        start, stop, _ = units.indices(len(self))
+        if stop <= start:
+            return float("nan")
+        count = stop - start
+        ticks = self.tick_sum(self.front + stop) - self.tick_sum(self.front + start)
+        return (count * self.now - ticks) / count
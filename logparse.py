@@ -0,0 +1,230 @@
+import argparse
+import ast
+import re
+import numpy as np
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+from backtest import load_trader_class, trader_output
+from datamodel import Listing, TradingState
+from replay import MarketReplay
+from simulator import CURRENCY
+
+# Every tick of the sandbox logs starts with its timestamp, glued to the first line printed
+TICK_LINE = re.compile(r"^(\d+) (.*)$")
+DEPTH_LINE = re.compile(r"^bot (ask|bid) depths: ?(\{.*\})$")
+ORDER_LINE = re.compile(r"^(BUY|SELL) ([A-Z_]+)(?: [A-Z]+)? (-?\d+)x (-?\d+)$")
+LEVEL = re.compile(r"(-?\d+): (-?\d+)")
+REPORT_LINE = re.compile(r"^REPORT .*?\sDuration: ([\d.]+) ms.*Max Memory Used: (\d+) MB")
+SUBMISSION_LOGS = "Submission logs:"
+
+
+class LogTick:
+    """
+    Everything the sandbox printed during one tick. The depths lines do not name their product,
+    so bids and asks are those of the single product that the logged trader printed.
+    """
+    __slots__ = ("timestamp", "bids", "asks", "orders", "position", "duration_ms", "memory_mb")
+
+    def __init__(self, timestamp : int):
+        self.timestamp = timestamp
+        self.bids : Dict[int, int] = {}
+        self.asks : Dict[int, int] = {}
+        self.orders : List[Tuple[str, int, int]] = []  # (product, price, quantity), sells negative
+        self.position : Dict[str, int] = {}
+        self.duration_ms : float = None
+        self.memory_mb : int = None
+
+
+def read_lines(filename : Path) -> Iterator[str]:
+    # The sandbox section only, the submission logs that follow it are not per tick
+    with open(filename, "r") as file:
+        for line in file:
+            line = line.rstrip("\r\n")
+            if line == SUBMISSION_LOGS:
+                return
+            yield line
+
+
+def parse_ticks(lines : Iterable[str]) -> Iterator[LogTick]:
+    """
+    Groups the lines of a sandbox log into ticks, yielding each tick once the next one starts.
+    """
+    tick = None
+    for line in lines:
+        match = TICK_LINE.match(line)
+        if match:
+            if tick is not None:
+                yield tick
+            tick = LogTick(int(match.group(1)))
+            line = match.group(2)
+        if tick is None:
+            continue
+
+        if line.startswith("bot "):
+            match = DEPTH_LINE.match(line)
+            if match:
+                levels = {int(price): int(volume) for price, volume in LEVEL.findall(match.group(2))}
+                if match.group(1) == "ask":
+                    tick.asks = levels
+                else:
+                    tick.bids = levels
+        elif line.startswith("BUY") or line.startswith("SELL"):
+            match = ORDER_LINE.match(line)
+            if match:
+                quantity = int(match.group(3))
+                tick.orders.append((match.group(2), int(match.group(4)), quantity if match.group(1) == "BUY" else -quantity))
+        elif line.startswith("{"):
+            # The position of the state, printed by the trader
+            tick.position = ast.literal_eval(line)
+        elif line.startswith("REPORT"):
+            match = REPORT_LINE.match(line)
+            if match:
+                tick.duration_ms = float(match.group(1))
+                tick.memory_mb = int(match.group(2))
+
+    if tick is not None:
+        yield tick
+
+
+class Columns:
+    """
+    Growable columns of one typecode filled a row at a time, each an array.array, so a value
+    costs its bytes instead of an object per tick. A column first seen at a later row is back
+    filled with default.
+    """
+
+    def __init__(self, typecode : str, default = 0):
+        self.typecode = typecode
+        self.default = default
+        self.columns : Dict[object, array] = {}
+        self.nrows = 0
+
+    def append(self, row : Dict):
+        for key in row:
+            if key not in self.columns:
+                self.columns[key] = array(self.typecode, [self.default]) * self.nrows
+        for key, column in self.columns.items():
+            column.append(row.get(key, self.default))
+        self.nrows += 1
+
+    def __getitem__(self, key) -> np.ndarray:
+        return np.asarray(self.columns[key]) if key in self.columns else np.full(self.nrows, self.default)
+
+
+class LoggedTicks:
+    """
+    What the logged trader saw and did on every tick, as columns: the printed position of each
+    product, the orders of the replayed product as (tick, price, quantity) rows sorted by tick
+    and the REPORT duration, nan on ticks without one.
+    """
+
+    def __init__(self, positions : Columns, order_ticks : array, order_prices : array, order_quantities : array, durations : array):
+        self.positions = {product: positions[product] for product in positions.columns}
+        self.order_ticks = np.asarray(order_ticks)
+        self.order_prices = np.asarray(order_prices)
+        self.order_quantities = np.asarray(order_quantities)
+        self.duration_ms = np.asarray(durations)
+
+    def position(self, t : int) -> Dict[str, int]:
+        return {product: int(column[t]) for product, column in self.positions.items()}
+
+    def orders(self, t : int) -> List[Tuple[int, int]]:
+        start, stop = np.searchsorted(self.order_ticks, [t, t + 1])
+        return list(zip(self.order_prices[start:stop].tolist(), self.order_quantities[start:stop].tolist()))
+
+
+def to_replay(ticks : Iterable[LogTick], product : str) -> Tuple[MarketReplay, LoggedTicks]:
+    """
+    Builds the MarketReplay of product from parsed ticks, best levels first like in the prices
+    csv, and returns it with the logged side of the ticks. Every tick is appended to growable
+    columns as it is parsed, so the ticks themselves are never kept. Ticks without depths hold
+    no row.
+    """
+    timestamps, rows, mid_prices = array("q"), array("q"), array("d")
+    levels, positions = Columns("q"), Columns("q")
+    order_ticks, order_prices, order_quantities, durations = array("q"), array("q"), array("q"), array("d")
+
+    for t, tick in enumerate(ticks):
+        bids = sorted(tick.bids.items(), reverse=True)
+        asks = sorted(tick.asks.items())
+        row = {}
+        for level, (price, volume) in enumerate(bids):
+            row["bid_prices", level], row["bid_volumes", level] = price, volume
+        for level, (price, volume) in enumerate(asks):
+            row["ask_prices", level], row["ask_volumes", level] = price, -volume
+        levels.append(row)
+
+        timestamps.append(tick.timestamp)
+        rows.append(t if bids or asks else -1)
+        mid_prices.append((bids[0][0] + asks[0][0]) / 2 if bids and asks else np.nan)
+
+        positions.append(tick.position)
+        for name, price, quantity in tick.orders:
+            if name == product:
+                order_ticks.append(t)
+                order_prices.append(price)
+                order_quantities.append(quantity)
+        durations.append(np.nan if tick.duration_ms is None else tick.duration_ms)
+
+    # (1, ticks, levels) like the arrays of a prices csv
+    nlevels = max([level + 1 for _, level in levels.columns] + [1])
+    arrays = {
+        side: np.stack([levels[side, level] for level in range(nlevels)], axis=-1).reshape(1, len(timestamps), nlevels)
+        for side in ("bid_prices", "bid_volumes", "ask_prices", "ask_volumes")
+    }
+
+    replay = MarketReplay([product], np.asarray(timestamps), **arrays,
+                          mid_prices=np.asarray(mid_prices)[np.newaxis], rows=np.asarray(rows)[np.newaxis])
+    return replay, LoggedTicks(positions, order_ticks, order_prices, order_quantities, durations)
+
+
+def diff_decisions(trader, replay : MarketReplay, logged : LoggedTicks) -> List[Dict]:
+    """
+    Runs trader over the replay with the positions of the log, so that every tick is compared
+    from the same state, and returns the ticks where its orders differ from the logged ones.
+    """
+    product = replay.products[0]
+    listings = {product: Listing(product, product, CURRENCY)}
+
+    diffs = []
+    for t, (timestamp, order_depths) in enumerate(replay):
+        state = TradingState(timestamp, listings, order_depths, {}, {}, logged.position(t), {})
+        orders = trader.run(state).get(product, [])
+
+        replayed = Counter((order.price, order.quantity) for order in orders)
+        logged_orders = Counter(logged.orders(t))
+        if replayed != logged_orders:
+            diffs.append({
+                "timestamp": timestamp,
+                "logged": sorted((logged_orders - replayed).elements()),
+                "replayed": sorted((replayed - logged_orders).elements()),
+            })
+    return diffs
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", type=Path, default=Path("logs/momentum_sliding_window_28.txt"))
+    parser.add_argument("--product", type=str, default="BANANAS", help="product of the depths lines in the log")
+    parser.add_argument("--trader", type=str, default="trader.Trader")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    replay, logged = to_replay(parse_ticks(read_lines(args.log)), args.product)
+    durations = logged.duration_ms[~np.isnan(logged.duration_ms)]
+    print(f"{len(replay)} ticks, {int((replay.rows >= 0).sum())} with {args.product} depths, "
+          f"{len(logged.order_ticks)} logged {args.product} orders")
+    if len(durations) > 0:
+        print(f"Reported durations: p50 {np.percentile(durations, 50):.2f} ms, max {durations.max():.2f} ms")
+
+    trader = load_trader_class(args.trader)()
+    with trader_output(args.verbose):
+        diffs = diff_decisions(trader, replay, logged)
+
+    print(f"{len(diffs)} ticks where {args.trader} differs from the log on {args.product}")
+    for diff in diffs[:args.top]:
+        print(diff["timestamp"], "logged:", diff["logged"], "replayed:", diff["replayed"])
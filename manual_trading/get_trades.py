@@ -1,40 +1,104 @@
 import argparse
-from copy import deepcopy
-from typing import Dict
-import matplotlib.pyplot as plt
-import networkx as nx
+import heapq
+import json
+from typing import Dict, List, Tuple
 import numpy as np
 from pathlib import Path
-import json
-
-
-def bellman_ford(G : nx.DiGraph, start : str, n_iter : int):
-
-    # Get initial conditions
-    nx.set_node_attributes(G, {start: 1}, name="gain")
-    nx.set_node_attributes(G, {start: [start]}, name="path")
-    prices = nx.get_edge_attributes(G, "price")
 
-    # Run Bellman Ford for n_iterations
-    for _ in range(n_iter):
 
-        # In each iteration get copy of state from previous iteration
-        gains = deepcopy(nx.get_node_attributes(G, name="gain"))
-        path_old = deepcopy(nx.get_node_attributes(G, name="path"))
-
-        # Iterate over all edges
-        for p1, p2 in G.edges:
-            
-            # Compute updated gains and compare to old gains
-            gain_new = gains[p1] * prices[(p1, p2)]
-            gain_old = nx.get_node_attributes(G, name="gain")[p2]
-            
-            if gain_new > gain_old:                
-                nx.set_node_attributes(G, {p2: gain_new}, name="gain")
-                nx.set_node_attributes(G, {p2: path_old[p1] + [p2]}, name="path")
-    
-
-def make_graph(data : Dict, radius = 10):
+def best_cycles(prices : np.ndarray, start : int, n_iter : int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Max-product dynamic program over the number of trades, in log space. gains[k, p] is the best
+    amount of p reachable from one unit of start with at most k trades and back[k, p] the
+    product traded into p at step k, or -1 when the best of step k - 1 was kept. Every row
+    of the matrix is one vectorized relaxation, so all n_iter <= N come out of one pass.
+    """
+    nproducts = len(prices)
+    with np.errstate(divide="ignore"):
+        log_prices = np.log(np.asarray(prices, dtype=float))
+
+    # Trading a product into itself is not an edge
+    np.fill_diagonal(log_prices, -np.inf)
+
+    log_gains = np.full((n_iter + 1, nproducts), -np.inf)
+    log_gains[0, start] = 0.0
+    back = np.full((n_iter + 1, nproducts), -1, dtype=np.int32)
+
+    for k in range(1, n_iter + 1):
+        candidates = log_gains[k - 1][:, np.newaxis] + log_prices
+        best = np.argmax(candidates, axis=0)
+        best_gain = candidates[best, np.arange(nproducts)]
+
+        # Only a strict improvement replaces the best of the previous step
+        improved = best_gain > log_gains[k - 1]
+        log_gains[k] = np.where(improved, best_gain, log_gains[k - 1])
+        back[k] = np.where(improved, best, -1)
+
+    return np.exp(log_gains), back
+
+
+def trace_path(back : np.ndarray, start : int, product : int, k : int) -> List[int]:
+    # Products visited by the best way of holding product after at most k trades
+    path = []
+    while k > 0:
+        if back[k, product] >= 0:
+            path.append(product)
+            product = int(back[k, product])
+        k -= 1
+    path.append(start)
+    return path[::-1]
+
+
+def top_cycles(prices : np.ndarray, start : int, max_len : int, top_k : int, fee : float = 0.0) -> List[Tuple[float, List[int]]]:
+    """
+    The top_k best simple cycles from start back to start with at most max_len trades, best
+    first, as (gain, path). A simple cycle trades into every product at most once, so start is
+    only at its ends and no shorter cycle is repeated inside it. Every trade pays fee, a fraction
+    of the amount traded, for fees or slippage. A branch and bound search: every partial path is
+    bounded by the best walk back to start in the trades left, from a DP that allows revisits,
+    and cut once it cannot beat the top_k found so far, so the ranking is exact.
+    """
+    nproducts = len(prices)
+    with np.errstate(divide="ignore"):
+        log_prices = np.log(np.asarray(prices, dtype=float)) + np.log1p(-fee)
+    np.fill_diagonal(log_prices, -np.inf)
+
+    # to_start[h, p] is the best log gain of a walk from p to start with at most h trades
+    to_start = np.full((max_len + 1, nproducts), -np.inf)
+    to_start[0, start] = 0.0
+    for h in range(1, max_len + 1):
+        to_start[h] = np.maximum(to_start[h - 1], np.max(log_prices + to_start[h - 1], axis=1))
+
+    # Min-heap of the top_k cycles found so far, the worst one first
+    found = []
+
+    def threshold() -> float:
+        return found[0][0] if len(found) == top_k else -np.inf
+
+    def search(path : List[int], log_gain : float):
+        product, trades_left = path[-1], max_len - len(path) + 1
+        bounds = log_gain + log_prices[product] + to_start[trades_left - 1]
+
+        # Best bound first, so the first branch that cannot make the top_k ends the loop
+        for q in np.argsort(-bounds, kind="stable").tolist():
+            if bounds[q] <= threshold():
+                break
+            if q == start:
+                cycle = (log_gain + log_prices[product, q], len(found), path + [start])
+                if len(found) < top_k:
+                    heapq.heappush(found, cycle)
+                else:
+                    heapq.heappushpop(found, cycle)
+            elif q not in path and trades_left > 1:
+                search(path + [q], log_gain + log_prices[product, q])
+
+    if top_k > 0:
+        search([start], 0.0)
+    return [(float(np.exp(log_gain)), path) for log_gain, _, path in sorted(found, key=lambda cycle: -cycle[0])]
+
+
+def make_graph(data : Dict, gains : np.ndarray, paths : List[List[str]], radius = 10):
+    import networkx as nx
 
     # Extract information
     products, prices = data["products"], data["prices"]
@@ -48,10 +112,10 @@ def make_graph(data : Dict, radius = 10):
         # Compute angle to ensure nice distribution of the nodes
         angle = 2 * np.pi * i / len(products)
 
-        # Add node with gain and prev attributes
+        # Add node with gain and path attributes
         G.add_node(
             p, 
-            gain=0, path=[], 
+            gain=gains[i], path=paths[i], 
             pos=(radius * np.cos(angle), radius * np.sin(angle))
         )
     
@@ -64,8 +128,9 @@ def make_graph(data : Dict, radius = 10):
     return G
 
 
-def draw(G : nx.DiGraph, start : str, out_file : Path):
-
+def draw(G, start : str, out_file : Path):
+    import matplotlib.pyplot as plt
+    import networkx as nx
     
     pos=nx.get_node_attributes(G,'pos')
     
@@ -104,9 +169,11 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--filename', type=Path)
-    parser.add_argument('--out_file', type=Path, default=Path("manual_trade.png"))
+    parser.add_argument('--out_file', type=Path, default=None, help="png of the graph, needs networkx and matplotlib")
     parser.add_argument('--start', type=str, default="Shells")
     parser.add_argument('--n_iter', type=int, default=5)
+    parser.add_argument('--top_k', type=int, default=10, help="number of ranked cycles to list, 0 for none")
+    parser.add_argument('--fee', type=float, default=0.0, help="fraction lost on every trade, for fees or slippage")
     args = parser.parse_args()
 
     # Load json with data
@@ -114,13 +181,30 @@ if __name__ == "__main__":
     if not args.start in data["products"]:
         raise ValueError(f"start must be in {set(data['products'])}")
 
-    # Make graph
-    G = make_graph(data)
-    bellman_ford(G, args.start, args.n_iter)
+    # Best cycle for every number of trades up to n_iter
+    products = data["products"]
+    start = products.index(args.start)
+    gains, back = best_cycles(np.array(data["prices"]), start, args.n_iter)
+    for k in range(1, args.n_iter + 1):
+        path_string = " -> ".join(products[p] for p in trace_path(back, start, start, k))
+        print(f"{k} trades:\t{gains[k, start] :.5}\t{path_string}")
 
-    path_string = " -> ".join(nx.get_node_attributes(G, name="path")[args.start])
+    path_string = " -> ".join(products[p] for p in trace_path(back, start, start, args.n_iter))
     print(f"Optimal strategy:\t{path_string}")
-    print(f"Optimal gain:\t\t{nx.get_node_attributes(G, name='gain')[args.start] :.5}")
+    print(f"Optimal gain:\t\t{gains[args.n_iter, start] :.5}")
+
+    # Ranked alternatives that trade into every product at most once, up to n_iter trades each
+    if args.top_k > 0:
+        print(f"Top {args.top_k} simple cycles with a fee of {args.fee:g} per trade:")
+        for rank, (gain, path) in enumerate(top_cycles(np.array(data["prices"]), start, args.n_iter, args.top_k, args.fee), 1):
+            print(f"{rank}.\t{gain :.5}\t{' -> '.join(products[p] for p in path)}")
 
     # Draw graph
-    draw(G, args.start, args.out_file)
+    if args.out_file is not None:
+        # Products that cannot be reached have no path
+        paths = [
+            [products[p] for p in trace_path(back, start, i, args.n_iter)] if gains[args.n_iter, i] > 0 else []
+            for i in range(len(products))
+        ]
+        G = make_graph(data, gains[args.n_iter], paths)
+        draw(G, args.start, args.out_file)
@@ -0,0 +1,43 @@
+import itertools
+import numpy as np
+from get_trades import top_cycles
+
+
+def brute_force_cycles(prices : np.ndarray, start : int, max_len : int, fee : float):
+    # Every simple cycle through start, by enumerating the ordered products between its ends
+    others = [p for p in range(len(prices)) if p != start]
+    cycles = []
+    for length in range(1, max_len):
+        for middle in itertools.permutations(others, length):
+            path = [start, *middle, start]
+            gain = np.prod([prices[a][b] * (1 - fee) for a, b in zip(path, path[1:])])
+            cycles.append((gain, path))
+    return sorted(cycles, key=lambda cycle: -cycle[0])
+
+
+def test_top_cycles_match_brute_force():
+    rng = np.random.default_rng(0)
+    for fee in [0.0, 0.01]:
+        prices = np.exp(rng.normal(0.0, 0.05, (6, 6)))
+        expected = brute_force_cycles(prices, 2, 5, fee)[:15]
+        result = top_cycles(prices, 2, 5, 15, fee)
+        np.testing.assert_allclose([gain for gain, _ in result], [gain for gain, _ in expected])
+        for gain, path in result:
+            assert np.isclose(gain, np.prod([prices[a][b] * (1 - fee) for a, b in zip(path, path[1:])]))
+
+
+def test_top_cycles_do_not_repeat_shorter_cycles():
+    # Shells -> Pizza -> Shells gains, so walks could repeat it or nest it in longer ones
+    prices = np.array([
+        [1.0, 0.5, 1.45, 0.75],
+        [1.95, 1.0, 3.1, 1.49],
+        [0.67, 0.31, 1.0, 0.48],
+        [1.34, 0.64, 1.98, 1.0],
+    ])
+    result = top_cycles(prices, 3, 5, 20)
+
+    assert len(result) == len(brute_force_cycles(prices, 3, 5, 0.0))
+    for _, path in result:
+        assert path[0] == path[-1] == 3
+        assert len(set(path[:-1])) == len(path) - 1
+    assert len({tuple(path) for _, path in result}) == len(result)
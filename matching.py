@@ -0,0 +1,124 @@
+import pandas as pd
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+from datamodel import Levels, Order, OrderDepth, Symbol, Time
+
+# (price, quantity) of one fill, the quantity is negative when we sell
+Fill = Tuple[int, int]
+
+
+def book_side(levels : Dict[int, int], reverse : bool) -> Tuple[List[int], List[int]]:
+    """
+    Prices and positive volumes of one side of an order depth, best level first. Packed
+    depths already hold their levels in that order.
+    """
+    if isinstance(levels, Levels):
+        return list(levels.prices), [abs(volume) for volume in levels.volumes]
+    prices = sorted(levels, reverse=reverse)
+    return prices, [abs(levels[price]) for price in prices]
+
+
+def load_market_trades(filename : Path) -> Dict[Tuple[Time, Symbol], List[Fill]]:
+    # (timestamp, symbol) -> (price, quantity) of every bot trade of a trades csv
+    df = pd.read_csv(filename, sep=";")
+    market_trades = defaultdict(list)
+    for timestamp, symbol, price, quantity in zip(df["timestamp"], df["symbol"], df["price"], df["quantity"]):
+        market_trades[(int(timestamp), symbol)].append((int(round(price)), int(quantity)))
+    return dict(market_trades)
+
+
+class MatchingEngine:
+    """
+    Matches our orders of one tick against the bot levels of that tick, per product, the way
+    the exchange does:
+
+    - an order set that could take the position over its limit, if every order was filled,
+      is rejected as a whole,
+    - every order sweeps the opposite levels in price priority, up to its limit price, and
+      trades at the price of the level. Liquidity taken by an order is gone for the next ones,
+    - what is left of an order rests at its limit price and, when market trades are given,
+      trades at that price against the bot trades of the tick that printed through it. Bot
+      trades at exactly our price fill the bot volume quoted there first, which is ahead of us
+      in the queue.
+    """
+
+    def __init__(self, position_limits : Dict[Symbol, int], market_trades : Dict[Tuple[Time, Symbol], List[Fill]] = None):
+        self.position_limits = position_limits
+        self.market_trades = market_trades or {}
+        self.rejected : Dict[Symbol, int] = defaultdict(int)
+
+    def match(self, timestamp : Time, product : Symbol, orders : List[Order], order_depth : OrderDepth, position : int) -> List[Fill]:
+        """
+        Returns the fills of orders in the order they happen, none when the set is rejected.
+        """
+        limit = self.position_limits[product]
+        buys = sum(order.quantity for order in orders if order.quantity > 0)
+        sells = -sum(order.quantity for order in orders if order.quantity < 0)
+        if position + buys > limit or position - sells < -limit:
+            self.rejected[product] += 1
+            return []
+
+        if order_depth is None:
+            order_depth = OrderDepth()
+        bid_prices, bid_volumes = book_side(order_depth.buy_orders, reverse=True)
+        ask_prices, ask_volumes = book_side(order_depth.sell_orders, reverse=False)
+
+        fills, resting = [], []
+        for order in orders:
+            if order.quantity > 0:
+                remaining = self.sweep(ask_prices, ask_volumes, order.price, order.quantity, 1, fills)
+                if remaining > 0:
+                    resting.append((order.price, remaining, 1, self.queue_ahead(bid_prices, bid_volumes, order.price)))
+            elif order.quantity < 0:
+                remaining = self.sweep(bid_prices, bid_volumes, order.price, -order.quantity, -1, fills)
+                if remaining > 0:
+                    resting.append((order.price, remaining, -1, self.queue_ahead(ask_prices, ask_volumes, order.price)))
+
+        trades = self.market_trades.get((timestamp, product))
+        if trades and resting:
+            self.match_resting(resting, [list(trade) for trade in trades], fills)
+
+        return fills
+
+    @staticmethod
+    def sweep(prices : List[int], volumes : List[int], limit_price : int, quantity : int, side : int, fills : List[Fill]) -> int:
+        # Takes levels, best first, while they are at or better than limit_price. Returns what is left
+        for k in range(len(prices)):
+            if quantity == 0 or (prices[k] - limit_price) * side > 0:
+                break
+            volume = min(volumes[k], quantity)
+            if volume == 0:
+                continue
+            volumes[k] -= volume
+            quantity -= volume
+            fills.append((prices[k], side * volume))
+        return quantity
+
+    @staticmethod
+    def queue_ahead(prices : List[int], volumes : List[int], price : int) -> int:
+        # Bot volume quoted on our side at our price
+        for level_price, volume in zip(prices, volumes):
+            if level_price == price:
+                return volume
+        return 0
+
+    @staticmethod
+    def match_resting(resting : List[Tuple[int, int, int, int]], trades : List[List[int]], fills : List[Fill]):
+        for price, remaining, side, ahead in resting:
+            for trade in trades:
+                if remaining == 0:
+                    break
+                # A buyer paid at most, or a seller got at least, our price
+                if (price - trade[0]) * side < 0 or trade[1] == 0:
+                    continue
+                if trade[0] == price and ahead > 0:
+                    queued = min(ahead, trade[1])
+                    ahead -= queued
+                    trade[1] -= queued
+                volume = min(remaining, trade[1])
+                if volume == 0:
+                    continue
+                trade[1] -= volume
+                remaining -= volume
+                fills.append((price, side * volume))
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+from statistics import StatisticsError
+from typing import Dict, Tuple
+from datamodel import OrderDepth, Product, Time
+
+
+def weighted_median(levels : Dict[int, int]) -> float:
+    """
+    Median of the prices in levels, each counted abs(volume) times. Equivalent to
+    statistics.median on the expanded list, but walks the sorted levels cumulatively.
+    """
+    prices = sorted(price for price, volume in levels.items() if volume != 0)
+    total = sum(abs(levels[price]) for price in prices)
+    if total == 0:
+        raise StatisticsError("no median for empty data")
+
+    # The median sits on units (total - 1) // 2 and total // 2 of the expanded list
+    lower_unit, upper_unit = (total - 1) // 2, total // 2
+    lower = None
+    seen = 0
+    for price in prices:
+        seen += abs(levels[price])
+        if lower is None and seen > lower_unit:
+            lower = price
+        if seen > upper_unit:
+            return lower if lower_unit == upper_unit else (lower + price) / 2
+
+
+def mid_price(order_depth : OrderDepth) -> float:
+    # Mean of the weighted medians of both sides of the book
+    return (weighted_median(order_depth.buy_orders) + weighted_median(order_depth.sell_orders)) / 2
+
+
+class MidPriceCache:
+    """
+    mid_price memoized per (timestamp, product), keeping the maxsize most recent entries.
+    """
+
+    def __init__(self, maxsize : int = 64):
+        self.maxsize = maxsize
+        self.cache : OrderedDict[Tuple[Time, Product], float] = OrderedDict()
+
+    def __call__(self, timestamp : Time, product : Product, order_depth : OrderDepth) -> float:
+        key = (timestamp, product)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        value = mid_price(order_depth)
+        self.cache[key] = value
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return value
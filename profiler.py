@@ -0,0 +1,183 @@
+import argparse
+import contextlib
+import functools
+import resource
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List
+from backtest import load_replay, load_trader_class, trader_output
+from simulator import simulate
+
+# Product branches of Trader.run, each one is a method of the trader
+BRANCHES = {
+    "PEARLS": "run_pearls",
+    "BANANAS/BERRIES": "run_bananas_berries",
+    "DIVING_GEAR": "run_diving_gear",
+    "COCONUTS/PINA_COLADAS": "run_coco_pina",
+}
+
+# Helpers timed on their class, as the trader creates their instances itself
+HELPERS = {
+    "SlidingWindowStatistics.print_stats": ("SlidingWindowStatistics", "print_stats"),
+    "CocoPinaCls.__call__": ("CocoPinaCls", "__call__"),
+}
+
+
+class LatencyProfiler:
+    """
+    Records the wall time of every Trader.run call, of its product branches and of the
+    helpers in HELPERS, and optionally the peak memory allocated during each run call.
+    """
+
+    def __init__(self, memory : bool = True):
+        self.memory = memory
+        self.timings : Dict[str, List[float]] = defaultdict(list)
+        self.allocations : List[int] = []
+        self.timestamps : List[int] = []
+
+    def timed(self, name : str, function : Callable) -> Callable:
+        timings = self.timings[name]
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings.append(time.perf_counter() - start)
+
+        return wrapper
+
+    def timed_run(self, run : Callable) -> Callable:
+        timings = self.timings["run"]
+
+        @functools.wraps(run)
+        def wrapper(state):
+            self.timestamps.append(state.timestamp)
+            if self.memory:
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            try:
+                return run(state)
+            finally:
+                timings.append(time.perf_counter() - start)
+                if self.memory:
+                    self.allocations.append(tracemalloc.get_traced_memory()[1] - baseline)
+
+        return wrapper
+
+    @contextlib.contextmanager
+    def instrument(self, trader):
+        """
+        Wraps the run method and branches of trader, and the helpers of its module, for the
+        duration of the block. Everything that the trader does not define is skipped.
+        """
+        module = sys.modules[type(trader).__module__]
+        patched = []
+        for name, (class_name, method_name) in HELPERS.items():
+            cls = getattr(module, class_name, None)
+            if cls is not None and method_name in vars(cls):
+                original = vars(cls)[method_name]
+                setattr(cls, method_name, self.timed(name, original))
+                patched.append((cls, method_name, original))
+
+        for name, method_name in BRANCHES.items():
+            if hasattr(trader, method_name):
+                setattr(trader, method_name, self.timed(name, getattr(trader, method_name)))
+        trader.run = self.timed_run(trader.run)
+
+        if self.memory:
+            tracemalloc.start()
+        try:
+            yield trader
+        finally:
+            if self.memory:
+                tracemalloc.stop()
+            for name in ["run", *BRANCHES.values()]:
+                trader.__dict__.pop(name, None)
+            for cls, method_name, original in patched:
+                setattr(cls, method_name, original)
+
+    def report(self, budget_ms : float) -> pd.DataFrame:
+        """
+        p50, p99 and max in milliseconds of everything timed, per call. Branches are called
+        once per product and tick, so their share is taken over the total time of run. The
+        budget is that of a whole run call, so only run is counted against it.
+        """
+        total_run = sum(self.timings["run"])
+        rows = []
+        for name in ["run", *BRANCHES, *HELPERS]:
+            timings = np.array(self.timings.get(name, [])) * 1000
+            if len(timings) == 0:
+                continue
+            rows.append({
+                "name": name,
+                "calls": len(timings),
+                "p50_ms": np.percentile(timings, 50),
+                "p99_ms": np.percentile(timings, 99),
+                "max_ms": timings.max(),
+                "share": timings.sum() / 1000 / total_run,
+                "over_budget": int((timings > budget_ms).sum()) if name == "run" else None,
+            })
+        return pd.DataFrame(rows).astype({"over_budget": "Int64"})
+
+    def memory_report(self) -> pd.DataFrame:
+        # Peak bytes allocated by Python during each run call, in KiB
+        allocations = np.array(self.allocations) / 1024
+        return pd.DataFrame([{
+            "calls": len(allocations),
+            "p50_kib": np.percentile(allocations, 50),
+            "p99_kib": np.percentile(allocations, 99),
+            "max_kib": allocations.max(),
+        }])
+
+    def over_budget(self, budget_ms : float) -> pd.DataFrame:
+        timings = np.array(self.timings["run"]) * 1000
+        slow = np.flatnonzero(timings > budget_ms)
+        return pd.DataFrame({"timestamp": np.array(self.timestamps)[slow], "duration_ms": timings[slow]})
+
+
+def profile(filename : Path, trader_spec : str, memory : bool = True, verbose : bool = False) -> LatencyProfiler:
+    """
+    Simulates a fresh instance of trader_spec over one prices csv under the profiler.
+    """
+    replay = load_replay(filename)
+    trader = load_trader_class(trader_spec)()
+
+    profiler = LatencyProfiler(memory)
+    with profiler.instrument(trader), trader_output(verbose):
+        simulate(trader, replay, progress=False)
+    return profiler
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prices", type=Path, required=True)
+    parser.add_argument("--trader", type=str, default="trader.Trader")
+    parser.add_argument("--budget_ms", type=float, default=100.0)
+    parser.add_argument("--no_memory", action="store_true", help="skip tracemalloc, which slows every call down")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    profiler = profile(args.prices, args.trader, not args.no_memory, args.verbose)
+
+    print(profiler.report(args.budget_ms).to_string(index=False, float_format="%.3f"))
+    if profiler.memory:
+        print()
+        print(profiler.memory_report().to_string(index=False, float_format="%.1f"))
+
+    # Same figure as the Max Memory Used of the sandbox reports, for the whole process
+    print()
+    print(f"Max memory used: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MB")
+
+    slow = profiler.over_budget(args.budget_ms)
+    print(f"{len(slow)} of {len(profiler.timings['run'])} run calls over the {args.budget_ms:g} ms budget")
+    if len(slow) > 0:
+        print(slow.sort_values("duration_ms", ascending=False).head(20).to_string(index=False, float_format="%.3f"))
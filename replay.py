@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+from datamodel import Observation, OrderDepth, PackedOrderDepth, Symbol
+
+
+class MarketReplay:
+    """
+    Columnar view of a prices csv. The file is indexed once into int arrays of shape
+    (products, ticks, levels) so that the order depths of a tick are built by lookup
+    instead of filtering the DataFrame on every timestamp.
+    """
+
+    bid_price_token : str = "bid_price_"
+    bid_volume_token : str = "bid_volume_"
+    ask_price_token : str = "ask_price_"
+    ask_volume_token : str = "ask_volume_"
+
+    # Build read-only PackedOrderDepth instead of dict backed OrderDepth
+    packed : bool = False
+
+    # Products that the exchange sends as observations, their mid price, instead of order depths
+    observed : Tuple[Symbol, ...] = ("DOLPHIN_SIGHTINGS",)
+
+    arrays = ("timestamps", "bid_prices", "bid_volumes", "ask_prices", "ask_volumes", "mid_prices", "rows")
+
+    def __init__(self, products : List[str], timestamps : np.ndarray,
+                 bid_prices : np.ndarray, bid_volumes : np.ndarray,
+                 ask_prices : np.ndarray, ask_volumes : np.ndarray,
+                 mid_prices : np.ndarray, rows : np.ndarray):
+
+        self.products = products
+        self.timestamps = timestamps
+
+        # (products, ticks, levels), a volume of 0 marks an empty level
+        self.bid_prices = bid_prices
+        self.bid_volumes = bid_volumes
+        self.ask_prices = ask_prices
+        self.ask_volumes = ask_volumes
+
+        # (products, ticks), rows holds the position of the line in the source frame or -1
+        self.mid_prices = mid_prices
+        self.rows = rows
+
+    @classmethod
+    def from_csv(cls, filename : Path, products : List[str] = None):
+        return cls.from_frame(pd.read_csv(filename, sep=";"), products)
+
+    @classmethod
+    def from_frame(cls, df : pd.DataFrame, products : List[str] = None):
+
+        if products is None:
+            products = list(df["product"].unique())
+
+        # Keep only the products we are asked for, in the order we are asked for
+        df = df.reset_index(drop=True)
+        product_idx = pd.Categorical(df["product"], categories=products).codes
+        df = df[product_idx >= 0]
+        product_idx = product_idx[product_idx >= 0]
+
+        timestamps = np.unique(df["timestamp"].to_numpy())
+        tick_idx = np.searchsorted(timestamps, df["timestamp"].to_numpy())
+
+        nlevels = len([col for col in df.columns if cls.bid_price_token in col])
+        shape = (len(products), len(timestamps), nlevels)
+
+        def level_array(token):
+            arr = np.zeros(shape, dtype=np.int64)
+            for level in range(nlevels):
+                col = df[token + str(level + 1)].fillna(0).to_numpy()
+                arr[product_idx, tick_idx, level] = col
+            return arr
+
+        mid_prices = np.full(shape[:2], np.nan)
+        mid_prices[product_idx, tick_idx] = df["mid_price"].to_numpy()
+
+        rows = np.full(shape[:2], -1, dtype=np.int64)
+        rows[product_idx, tick_idx] = df.index.to_numpy()
+
+        return cls(
+            list(products), timestamps,
+            level_array(cls.bid_price_token), level_array(cls.bid_volume_token),
+            level_array(cls.ask_price_token), level_array(cls.ask_volume_token),
+            mid_prices, rows
+        )
+
+    def share(self) -> Tuple[Dict, List[SharedMemory]]:
+        """
+        Copies the arrays into shared memory. Returns a picklable handle for attach and the
+        blocks themselves, which the owner keeps alive and unlinks once the workers are done.
+        """
+        handle = {"products": self.products}
+        blocks = []
+        for name in MarketReplay.arrays:
+            arr = getattr(self, name)
+            block = SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+            handle[name] = (block.name, arr.shape, arr.dtype.str)
+            blocks.append(block)
+        return handle, blocks
+
+    @classmethod
+    def attach(cls, handle : Dict):
+        # Views on the blocks of another process, nothing is copied
+        blocks = {name: SharedMemory(name=handle[name][0]) for name in cls.arrays}
+        replay = cls(handle["products"], **{
+            name: np.ndarray(handle[name][1], dtype=handle[name][2], buffer=blocks[name].buf)
+            for name in cls.arrays
+        })
+        replay.blocks = blocks
+        return replay
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __iter__(self) -> Iterator[Tuple[int, Dict[Symbol, OrderDepth]]]:
+        for t in range(len(self.timestamps)):
+            yield int(self.timestamps[t]), self.order_depths(t)
+
+    def order_depths(self, t : int) -> Dict[Symbol, OrderDepth]:
+        order_depths = {}
+        for p, product in enumerate(self.products):
+            if self.rows[p, t] < 0 or product in self.observed:
+                continue
+
+            if self.packed:
+                order_depths[product] = self.packed_order_depth(p, t)
+                continue
+
+            # Load bot orders
+            order_depth = OrderDepth()
+            order_depth.buy_orders = merge_levels(self.bid_prices[p, t], self.bid_volumes[p, t])
+            order_depth.sell_orders = merge_levels(self.ask_prices[p, t], -self.ask_volumes[p, t])
+            order_depths[product] = order_depth
+
+        return order_depths
+
+    def observations(self, t : int) -> Dict[Symbol, Observation]:
+        observations = {}
+        for p, product in enumerate(self.products):
+            if product in self.observed and self.rows[p, t] >= 0:
+                observations[product] = self.mid_prices[p, t].item()
+        return observations
+
+    def packed_order_depth(self, p : int, t : int) -> PackedOrderDepth:
+        # Same levels as the dict OrderDepth, best first, packed into arrays
+        bids = merge_levels(self.bid_prices[p, t], self.bid_volumes[p, t])
+        asks = merge_levels(self.ask_prices[p, t], -self.ask_volumes[p, t])
+        return PackedOrderDepth(list(bids), list(bids.values()), list(asks), list(asks.values()))
+
+
+def merge_levels(prices : np.ndarray, volumes : np.ndarray) -> Dict[int, int]:
+    """
+    Price -> volume of one side of a book, in the order of the csv levels. Empty levels are
+    dropped and a price that is listed on several levels gets the sum of their volumes.
+    """
+    levels = {}
+    for price, volume in zip(prices.tolist(), volumes.tolist()):
+        if volume != 0:
+            levels[price] = levels.get(price, 0) + volume
+    return levels
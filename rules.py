@@ -0,0 +1,108 @@
+"""
+Decision rules as small expressions over features of the tick. A rule such as
+
+    Rule("(price > entry_first) | (age_last > close_long_age)", close_long_age=10000)
+
+is compiled once. When it is evaluated for a price level it only computes the features that
+its expression names. The inventory means come from prefix sums, O(1) for the entry prices
+and O(log lots) for the ages, and the window percentiles are computed once per tick however many levels and rules ask for
+them. Use & and | rather than and / or: any parameter can then be a numpy array, and the
+rule returns one decision per parameter variant in a single evaluation.
+
+Features:
+    price, volume       the level being decided on
+    entry_first         mean entry price of inventory[:volume]
+    age_first           mean age of inventory[:volume]
+    age_last            mean age of inventory[-volume:]
+    bid_percentile(p)   percentile of the bid sliding window, likewise ask_percentile(p)
+    bid_length          ticks in the bid sliding window, likewise ask_length
+    dolphins            StreamingSignal of DOLPHIN_SIGHTINGS, None before the first observation
+
+The slices have Python semantics, a negative volume drops units from the end and
+inventory[-0:] is the whole inventory. The mean of no units is nan, which compares false.
+"""
+
+from typing import Dict, List
+import numpy as np
+from ledger import LotAges
+
+
+class Inventory:
+    """
+    Entry prices of the units of one side of the inventory, oldest first, as prefix sums, and
+    their ages. Units closed from the front are dropped by moving an offset, the ages are
+    closed by their owner.
+    """
+
+    def __init__(self, prices : List[int], ages : LotAges):
+        self.price_sums = np.concatenate([[0.0], np.cumsum(prices, dtype=float)])
+        self.ages = ages
+        self.offset = 0
+
+    def __len__(self) -> int:
+        return len(self.price_sums) - 1 - self.offset
+
+    def take(self, quantity : int):
+        self.offset += min(abs(quantity), len(self))
+
+    def mean_price(self, units : slice) -> float:
+        start, stop, _ = units.indices(len(self))
+        if stop <= start:
+            return np.nan
+        return (self.price_sums[self.offset + stop] - self.price_sums[self.offset + start]) / (stop - start)
+
+
+class TickFeatures:
+    """
+    Features shared by every level and rule of one tick. Percentiles are cached per value.
+    """
+
+    def __init__(self, bid_window, ask_window, dolphins = None):
+        self.windows = {"bid": bid_window, "ask": ask_window}
+        self.dolphins = dolphins
+        self.percentiles : Dict = {}
+
+    def percentile(self, side : str, perc) -> float:
+        if np.ndim(perc) > 0:
+            return np.array([self.percentile(side, p) for p in np.ravel(perc)]).reshape(np.shape(perc))
+        key = (side, perc)
+        if key not in self.percentiles:
+            self.percentiles[key] = self.windows[side].get_percentile(perc)
+        return self.percentiles[key]
+
+
+# How every feature is computed from (price, volume, inventory, tick)
+FEATURES = {
+    "price": lambda price, volume, inventory, tick: price,
+    "volume": lambda price, volume, inventory, tick: volume,
+    "entry_first": lambda price, volume, inventory, tick: inventory.mean_price(slice(None, volume)),
+    "age_first": lambda price, volume, inventory, tick: inventory.ages.mean_age(slice(None, volume)),
+    "age_last": lambda price, volume, inventory, tick: inventory.ages.mean_age(slice(-volume, None)),
+    "bid_percentile": lambda price, volume, inventory, tick: lambda perc: tick.percentile("bid", perc),
+    "ask_percentile": lambda price, volume, inventory, tick: lambda perc: tick.percentile("ask", perc),
+    "bid_length": lambda price, volume, inventory, tick: tick.windows["bid"].length(),
+    "ask_length": lambda price, volume, inventory, tick: tick.windows["ask"].length(),
+    "dolphins": lambda price, volume, inventory, tick: tick.dolphins,
+}
+
+
+class Rule:
+
+    def __init__(self, expression : str, **params):
+        self.expression = expression
+        self.params = params
+        self.code = compile(expression, "<rule>", "eval")
+
+        # Only the features the expression names are computed
+        unknown = [name for name in self.code.co_names if name not in FEATURES and name not in params]
+        if unknown:
+            raise ValueError(f"unknown names {unknown} in rule {expression!r}")
+        self.features = [name for name in self.code.co_names if name in FEATURES and name not in params]
+
+    def __call__(self, price : int, volume : int, inventory : Inventory, tick : TickFeatures):
+        scope = {name: FEATURES[name](price, volume, inventory, tick) for name in self.features}
+        scope.update(self.params)
+        return eval(self.code, {"__builtins__": {}}, scope)
+
+    def __repr__(self):
+        return f"Rule({self.expression!r}, {self.params})"
@@ -0,0 +1,39 @@
+from collections import deque
+import numpy as np
+
+
+class StreamingSignal:
+    """
+    Features of one observed series, such as DOLPHIN_SIGHTINGS, updated in O(1) per tick: the
+    change over the last diff_lag ticks, an exponentially weighted mean and a jump flag, set on
+    the ticks where the series moved by more than jump_threshold since the tick before. Only
+    the last diff_lag + 1 values are kept.
+    """
+
+    def __init__(self, diff_lag : int = 10, ewma_alpha : float = 0.1, jump_threshold : float = 5.0):
+        self.diff_lag = diff_lag
+        self.ewma_alpha = ewma_alpha
+        self.jump_threshold = jump_threshold
+
+        self.values = deque(maxlen=diff_lag + 1)
+        self.ewma = np.nan
+        self.jump = False
+        self.last_jump = 0.0
+
+    def update(self, value : float):
+        step = value - self.values[-1] if len(self.values) > 0 else 0.0
+        self.jump = abs(step) > self.jump_threshold
+        if self.jump:
+            self.last_jump = step
+
+        self.values.append(value)
+        self.ewma = value if np.isnan(self.ewma) else self.ewma + self.ewma_alpha * (value - self.ewma)
+
+    @property
+    def value(self) -> float:
+        return self.values[-1] if len(self.values) > 0 else np.nan
+
+    @property
+    def diff(self) -> float:
+        # nan until diff_lag ticks were seen
+        return self.values[-1] - self.values[0] if len(self.values) > self.diff_lag else np.nan
@@ -1,87 +1,282 @@
 import argparse
-from turtle import pos, position
+import itertools
+import shutil
+import tempfile
+import zipfile
 import numpy as np
 import pandas as pd
 from pathlib import Path
-from datamodel import OrderDepth, TradingState, Order, Listing, Trade
-from typing import Dict, List
+from datamodel import OrderDepth, TradingState
+from typing import Dict, Iterable, Iterator, List, Tuple
 from tqdm.auto import tqdm
+import store
+from matching import MatchingEngine
+from replay import MarketReplay
 
 #! change this import to get the newest Trader
 from trader import Trader
 
-# def line_to_state()
+# Every stage below is a generator that holds at most one chunk of rows, so memory does not
+# grow with the number of days simulated:
+#   read_chunks -> read_rows -> assemble_ticks -> build_order_depths -> run_trader -> match_orders -> MarkToMarket
 
+CHUNKSIZE = 100000
 
-if __name__ == "__main__":
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--in_file", type=Path)
-    parser.add_argument("--n_bots", type=int, default=3)
-    # parser.add_argument("--out_file", type=Path)
-    args = parser.parse_args()
-    nbots = args.n_bots
+def read_chunks(filenames : List[Path], chunksize : int = CHUNKSIZE) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Columns of chunksize rows at a time. Files with a fresh store are sliced from its memory
+    mapped columns, the others are read in chunks from the csv without building a store.
+    """
+    for filename in filenames:
+        if store.is_fresh(filename):
+            columns = store.load_columns(filename)
+            categories = store.read_meta(filename)["categories"]
+            values = {column: np.array(categories[column], dtype=object) for column in categories}
+            nrows = len(next(iter(columns.values())))
+            for start in range(0, nrows, chunksize):
+                yield {
+                    column: values[column][arr[start:start + chunksize]] if column in values else arr[start:start + chunksize]
+                    for column, arr in columns.items()
+                }
+        else:
+            for chunk in pd.read_csv(filename, sep=";", chunksize=chunksize):
+                yield {column: chunk[column].to_numpy() for column in chunk.columns}
 
 
-    # our trader
-    trader = Trader()
-    commodities = list(trader.limits.keys())
+def read_rows(chunks : Iterable[Dict[str, np.ndarray]], nbots : int) -> Iterator[Tuple]:
+    # (day, timestamp, product, mid price, bid prices, bid volumes, ask prices, ask volumes) of every row
+    for chunk in chunks:
+        levels = [
+            [chunk[f"{token}_{i}"].tolist() for i in range(1, nbots + 1)]
+            for token in ["bid_price", "bid_volume", "ask_price", "ask_volume"]
+        ]
+        days = chunk["day"].tolist() if "day" in chunk else itertools.repeat(0)
+        columns = [days, chunk["timestamp"].tolist(), chunk["product"].tolist(), chunk["mid_price"].tolist()]
+        for row in zip(*columns, *(zip(*side) for side in levels)):
+            yield row
+
+
+class Tick:
+    """
+    One (day, timestamp) on its way through the pipeline, each stage fills in its part.
+    """
+    __slots__ = ("day", "timestamp", "order_depths", "mid_prices", "observations", "orders", "fills")
 
-    df = pd.read_csv(args.in_file, sep=";").groupby(by=["timestamp"])
-    position = {c: 0 for c in trader.limits}
-    gain = 0
+    def __init__(self, day : int, timestamp : int, order_depths : Dict[str, OrderDepth], mid_prices : Dict[str, float], observations : Dict[str, float]):
+        self.day = day
+        self.timestamp = timestamp
+        self.order_depths = order_depths
+        self.mid_prices = mid_prices
+        self.observations = observations
+        self.orders : Dict[str, List] = {}
+        self.fills : Dict[str, List[Tuple[int, int]]] = {}
 
 
-    for time, timestamp in tqdm(df):
+def assemble_ticks(rows : Iterable[Tuple]) -> Iterator[Tuple[Tuple[int, int], List[Tuple]]]:
+    # Consecutive rows of the same (day, timestamp) form one tick
+    for key, tick_rows in itertools.groupby(rows, key=lambda row: (row[0], row[1])):
+        yield key, list(tick_rows)
 
-        # Create the orders
-        order_depths = {}
-        for row in timestamp.to_dict(orient="records"):
 
-            c = row["product"]
+def build_order_depths(ticks : Iterable[Tuple[Tuple[int, int], List[Tuple]]]) -> Iterator[Tick]:
+    for (day, timestamp), rows in ticks:
+        order_depths, mid_prices, observations = {}, {}, {}
+        for _, _, c, mid_price, bid_prices, bid_volumes, ask_prices, ask_volumes in rows:
+            if c in MarketReplay.observed:
+                observations[c] = mid_price
+                continue
 
-            # Load bot orders
+            # Load bot orders, missing levels are nan
             order_depth = OrderDepth()
-            for i in range(1, nbots + 1):
+            for price, volume in zip(bid_prices, bid_volumes):
+                if price == price:
+                    order_depth.buy_orders[int(price)] = order_depth.buy_orders.get(int(price), 0) + int(volume)
+            for price, volume in zip(ask_prices, ask_volumes):
+                if price == price:
+                    order_depth.sell_orders[int(price)] = order_depth.sell_orders.get(int(price), 0) - int(volume)
 
-                # Add buy orders
-                if not pd.isnull(row[f"bid_price_{i}"]):
+            order_depths[c] = order_depth
+            mid_prices[c] = mid_price
+        yield Tick(day, timestamp, order_depths, mid_prices, observations)
 
-                    if not int(row[f"bid_price_{i}"]) in order_depth.buy_orders:
-                        order_depth.buy_orders[int(row[f"bid_price_{i}"])] = 0
 
-                    order_depth.buy_orders[int(row[f"bid_price_{i}"])] += int(row[f"bid_volume_{i}"])
-                
-                # Add ask offerings
-                if not pd.isnull(row[f"ask_price_{i}"]):
+def run_trader(trader, ticks : Iterable[Tick], position : Dict[str, int]) -> Iterator[Tick]:
+    for tick in ticks:
+        state = TradingState(tick.timestamp, {}, tick.order_depths, {}, {}, position, tick.observations)
+        tick.orders = trader.run(state)
+        yield tick
 
-                    if not int(row[f"ask_price_{i}"]) in order_depth.sell_orders:
-                        order_depth.sell_orders[int(row[f"ask_price_{i}"])] = 0
 
-                    order_depth.sell_orders[int(row[f"ask_price_{i}"])] -= int(row[f"ask_volume_{i}"])
+def match_orders(engine : MatchingEngine, ticks : Iterable[Tick], position : Dict[str, int]) -> Iterator[Tick]:
+    # Fills are applied to position before the next tick is read
+    for tick in ticks:
+        for c, orders in tick.orders.items():
+            tick.fills[c] = engine.match(tick.timestamp, c, orders, tick.order_depths.get(c), position[c])
+            for price, quantity in tick.fills[c]:
+                position[c] += quantity
+        yield tick
+
+
+class ColumnWriter:
+    """
+    Appends rows of fixed width columns to temporary files, a buffer of rows at a time, and
+    packs them into one .npz once the run is over, so the series never sit in memory.
+    """
+
+    def __init__(self, path : Path, columns : Dict[str, Tuple[str, Tuple]], buffer_size : int = 10000):
+        self.path = Path(path)
+        self.columns = columns
+        self.buffer_size = buffer_size
+        self.buffers = {name: [] for name in columns}
+        self.files = {name: tempfile.TemporaryFile() for name in columns}
+        self.nrows = 0
+
+    def append(self, **row):
+        for name, value in row.items():
+            self.buffers[name].append(value)
+        self.nrows += 1
+        if len(self.buffers[next(iter(self.columns))]) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        for name, (dtype, _) in self.columns.items():
+            np.asarray(self.buffers[name], dtype=dtype).tofile(self.files[name])
+            self.buffers[name] = []
+
+    def close(self, **constants : np.ndarray):
+        """
+        Writes the .npz, every column as an array of nrows rows, plus the given constant arrays.
+        """
+        self.flush()
+        with zipfile.ZipFile(self.path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name, (dtype, shape) in self.columns.items():
+                with archive.open(name + ".npy", "w", force_zip64=True) as out:
+                    header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": (self.nrows, *shape)}
+                    np.lib.format.write_array_header_2_0(out, header)
+                    self.files[name].seek(0)
+                    shutil.copyfileobj(self.files[name], out)
+                self.files[name].close()
+            for name, arr in constants.items():
+                with archive.open(name + ".npy", "w") as out:
+                    np.lib.format.write_array(out, np.asarray(arr), allow_pickle=False)
+
+
+class MarkToMarket:
+    """
+    PnL sink. Keeps the cash and position of every product and marks them each tick against the
+    last book seen for that product, at the mid price and at the liquidation value, the best bid
+    for a long and the best ask for a short. Drawdown, exposure and turnover are running
+    aggregates, the per tick series go to writer when one is given.
+    """
+
+    def __init__(self, products : List[str], position : Dict[str, int], writer : ColumnWriter = None):
+        self.products = products
+        self.position = position
+        self.writer = writer
+
+        self.cash = {c: 0.0 for c in products}
+        self.turnover = {c: 0.0 for c in products}
+        self.mid_prices = {c: np.nan for c in products}
+        self.best_bids = {c: np.nan for c in products}
+        self.best_asks = {c: np.nan for c in products}
+
+        self.peak = 0.0
+        self.max_drawdown = 0.0
+        self.max_exposure = 0.0
+        self.equity = 0.0
+        self.liquidation = 0.0
+
+    def mark(self, c : str) -> Tuple[float, float]:
+        # Mark to mid and liquidation value of the position. Until a price was seen for one of
+        # them the other stands in, then the other side of the book, which the position was
+        # opened against
+        position = self.position[c]
+        if position == 0:
+            return 0.0, 0.0
+        exit_price, entry_price = (self.best_bids[c], self.best_asks[c]) if position > 0 else (self.best_asks[c], self.best_bids[c])
+        mid_price = first_valid(self.mid_prices[c], exit_price, entry_price)
+        return position * mid_price, position * first_valid(exit_price, mid_price)
+
+    def update(self, tick : Tick):
+        for c, fills in tick.fills.items():
+            for price, quantity in fills:
+                self.cash[c] -= quantity * price
+                self.turnover[c] += abs(quantity) * price
+
+        for c in self.products:
+            order_depth = tick.order_depths.get(c)
+            if order_depth is not None:
+                if len(order_depth.buy_orders) > 0:
+                    self.best_bids[c] = max(order_depth.buy_orders)
+                if len(order_depth.sell_orders) > 0:
+                    self.best_asks[c] = min(order_depth.sell_orders)
+                # A one sided book has a mid price of 0 in the csv, keep the last valid one
+                if tick.mid_prices[c] > 0:
+                    self.mid_prices[c] = tick.mid_prices[c]
+
+        marks = [self.mark(c) for c in self.products]
+        equity = [self.cash[c] + value for c, (value, _) in zip(self.products, marks)]
+        liquidation = [self.cash[c] + value for c, (_, value) in zip(self.products, marks)]
+        exposure = [abs(value) for value, _ in marks]
+
+        self.equity, self.liquidation = float(sum(equity)), float(sum(liquidation))
+        self.peak = max(self.peak, self.equity)
+        self.max_drawdown = max(self.max_drawdown, self.peak - self.equity)
+        self.max_exposure = max(self.max_exposure, float(sum(exposure)))
+
+        if self.writer is not None:
+            self.writer.append(
+                day=tick.day, timestamp=tick.timestamp,
+                equity=self.equity, liquidation=self.liquidation, drawdown=self.peak - self.equity,
+                exposure=sum(exposure), turnover=sum(self.turnover.values()),
+                position=[self.position[c] for c in self.products],
+                product_equity=equity, product_liquidation=liquidation,
+            )
+
+    def run(self, ticks : Iterable[Tick]):
+        for tick in tqdm(ticks):
+            self.update(tick)
+        if self.writer is not None:
+            self.writer.close(products=np.array(self.products))
+
+
+def first_valid(*prices : float) -> float:
+    return next((price for price in prices if not np.isnan(price)), 0.0)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--in_file", type=Path, nargs="+")
+    parser.add_argument("--n_bots", type=int, default=3)
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE)
+    parser.add_argument("--out_file", type=Path, default=None, help="npz of the per tick equity and risk series")
+    args = parser.parse_args()
+    nbots = args.n_bots
+
+
+    # our trader
+    trader = Trader()
+    products = list(trader.limits.keys())
+    position = {c: 0 for c in products}
+    engine = MatchingEngine(trader.limits)
+
+    writer = None
+    if args.out_file is not None:
+        nproducts = len(products)
+        writer = ColumnWriter(args.out_file, {
+            "day": ("i4", ()), "timestamp": ("i8", ()),
+            "equity": ("f8", ()), "liquidation": ("f8", ()), "drawdown": ("f8", ()),
+            "exposure": ("f8", ()), "turnover": ("f8", ()),
+            "position": ("i4", (nproducts,)),
+            "product_equity": ("f8", (nproducts,)), "product_liquidation": ("f8", (nproducts,)),
+        })
+
+    ticks = assemble_ticks(read_rows(read_chunks(args.in_file, args.chunksize), nbots))
+    sink = MarkToMarket(products, position, writer)
+    sink.run(match_orders(engine, run_trader(trader, build_order_depths(ticks), position), position))
 
-            order_depths[c] = order_depth
-        
-        # Get state
-        state = TradingState(time, {}, order_depths, {}, {}, position, {})
-
-        # Update state
-        for c, trades in trader.run(state).items():
-            for trade in trades:
-                position[c] += trade.quantity
-                gain -= trade.quantity * trade.price
-
-    # Get to zero state
-    
-    print(gain)
     print(position)
-    for row in timestamp.to_dict(orient="records"):
-        if position[row["product"]] != 0:
-            if position[row["product"]] < 0:
-                price = min([row[f"ask_price_{i}"] for i in range(1, nbots + 1) if not pd.isnull(row[f"ask_price_{i}"])])
-            else:
-                price = max([row[f"buy_price_{i}"] for i in range(1, nbots + 1) if not pd.isnull(row[f"buy_price_{i}"])])
-            gain += position[row["product"]] * price
-            position[row["product"]] = 0
-
-    print(gain)
+    print(f"Equity {sink.equity:.1f}, after flattening at the last book of each product {sink.liquidation:.1f}")
+    print(f"Max drawdown {sink.max_drawdown:.1f}, max exposure {sink.max_exposure:.1f}, turnover {sum(sink.turnover.values()):.1f}")
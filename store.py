@@ -0,0 +1,181 @@
+"""
+Binary columnar copy of the prices csv files. Each csv is converted once into a directory of
+.npy files next to it, data/prices_round_3_day_2.csv into data/prices_round_3_day_2.store/,
+holding every csv column and the arrays of its MarketReplay. Loading maps the files read only,
+so that every process that loads the same day shares the same pages.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List
+from replay import MarketReplay
+
+
+VERSION = 1
+META = "meta.json"
+
+
+def store_dir(filename : Path) -> Path:
+    filename = Path(filename)
+    return filename.with_name(filename.stem + ".store")
+
+
+def file_hash(filename : Path) -> str:
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def read_meta(filename : Path) -> Dict:
+    try:
+        with open(store_dir(filename) / META, "r") as file:
+            meta = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return meta if meta.get("version") == VERSION else None
+
+
+def write_atomic(path : Path, write):
+    # Write to a temporary file first, so readers never see a partially written file
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as file:
+        write(file)
+    os.replace(tmp, path)
+
+
+def is_fresh(filename : Path) -> bool:
+    """
+    The store is fresh when the csv has the size and mtime it was built from. When only the
+    mtime moved, the csv is hashed and the store kept if the content is the same.
+    """
+    meta = read_meta(filename)
+    if meta is None:
+        return False
+
+    stat = os.stat(filename)
+    if meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    if meta["size"] != stat.st_size or meta["sha1"] != file_hash(filename):
+        return False
+
+    meta["mtime_ns"] = stat.st_mtime_ns
+    write_atomic(store_dir(filename) / META, lambda file: file.write(json.dumps(meta).encode()))
+    return True
+
+
+def build(filename : Path):
+    """
+    Converts one prices csv. Text columns are stored as int codes into the list of their values.
+    """
+    directory = store_dir(filename)
+    directory.mkdir(exist_ok=True)
+    (directory / META).unlink(missing_ok=True)
+
+    stat = os.stat(filename)
+    df = pd.read_csv(filename, sep=";")
+
+    columns, categories = [], {}
+    for column in df.columns:
+        values = df[column]
+        if not pd.api.types.is_numeric_dtype(values):
+            categories[column] = list(values.unique())
+            values = pd.Categorical(values, categories=categories[column]).codes.astype(np.int32)
+        columns.append(column)
+        save(directory / f"frame.{column}.npy", np.asarray(values))
+
+    replay = MarketReplay.from_frame(df)
+    for name in MarketReplay.arrays:
+        save(directory / f"replay.{name}.npy", getattr(replay, name))
+
+    # The meta file is written last, a store without one is rebuilt
+    meta = {
+        "version": VERSION, "source": Path(filename).name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+        "sha1": file_hash(filename), "columns": columns, "categories": categories, "products": replay.products
+    }
+    write_atomic(directory / META, lambda file: file.write(json.dumps(meta).encode()))
+
+
+def save(path : Path, arr : np.ndarray):
+    write_atomic(path, lambda file: np.save(file, arr, allow_pickle=False))
+
+
+def ensure(filename : Path) -> Dict:
+    # Builds the store of filename when it is missing or stale and returns its meta
+    if not is_fresh(filename):
+        build(filename)
+    return read_meta(filename)
+
+
+def load_replay(filename : Path, products : List[str] = None) -> MarketReplay:
+    """
+    MarketReplay of the csv, memory mapped. Asking for other products than the ones of the csv,
+    or in another order, copies the arrays of those products.
+    """
+    meta = ensure(filename)
+    directory = store_dir(filename)
+    arrays = {name: np.load(directory / f"replay.{name}.npy", mmap_mode="r") for name in MarketReplay.arrays}
+
+    stored = meta["products"]
+    if products is None or list(products) == stored:
+        return MarketReplay(list(stored), **arrays)
+
+    # Products that are not in the csv have no rows, as in MarketReplay.from_frame
+    fill = {"mid_prices": np.nan, "rows": -1}
+    for name in MarketReplay.arrays:
+        if name == "timestamps":
+            continue
+        arr = arrays[name]
+        selected = np.full((len(products),) + arr.shape[1:], fill.get(name, 0), dtype=arr.dtype)
+        for k, product in enumerate(products):
+            if product in stored:
+                selected[k] = arr[stored.index(product)]
+        arrays[name] = selected
+    return MarketReplay(list(products), **arrays)
+
+
+def load_columns(filename : Path) -> Dict[str, np.ndarray]:
+    """
+    Memory mapped columns of the csv. Text columns are left as int codes, their values are
+    in read_meta(filename)["categories"].
+    """
+    meta = ensure(filename)
+    directory = store_dir(filename)
+    return {column: np.load(directory / f"frame.{column}.npy", mmap_mode="r") for column in meta["columns"]}
+
+
+def load_frame(filename : Path) -> pd.DataFrame:
+    """
+    The csv as pd.read_csv(filename, sep=";") would return it, read from the store.
+    """
+    columns = load_columns(filename)
+    categories = read_meta(filename)["categories"]
+
+    data = {}
+    for column, values in columns.items():
+        if column in categories:
+            # The str dtype that read_csv gives text columns
+            values = pd.Categorical.from_codes(values, categories=categories[column]).astype("str")
+        data[column] = values
+    return pd.DataFrame(data)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", type=Path, nargs="+")
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    for filename in args.files:
+        if args.force or not is_fresh(filename):
+            build(filename)
+            print("Built", store_dir(filename))
+        else:
+            print("Fresh", store_dir(filename))
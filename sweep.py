@@ -0,0 +1,134 @@
+import argparse
+import itertools
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List
+from tqdm.auto import tqdm
+from backtest import load_trader_class, max_drawdown, trader_output
+from replay import MarketReplay
+from simulator import replay_products, simulate
+from store import load_replay
+
+# Replays attached from shared memory, one set per worker process
+_replays : Dict[str, MarketReplay] = {}
+
+
+def expand_grid(grid : Dict) -> List[Dict]:
+    """
+    Expands a nested grid such as {"coco_pina_params": {"beta": [0.52, 0.53], "lag": [4, 5]}}
+    into one nested dict of trader keyword arguments per combination of the listed values.
+    """
+    paths, values = [], []
+
+    def collect(node, path):
+        for key, value in node.items():
+            if isinstance(value, dict):
+                collect(value, path + (key,))
+            else:
+                paths.append(path + (key,))
+                values.append(value if isinstance(value, list) else [value])
+
+    collect(grid, ())
+
+    points = []
+    for combination in itertools.product(*values):
+        point = {}
+        for path, value in zip(paths, combination):
+            node = point
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = value
+        points.append(point)
+    return points
+
+
+def flatten(point : Dict, prefix : str = "") -> Dict:
+    # {"coco_pina_params": {"beta": 0.53}} -> {"coco_pina_params.beta": 0.53}
+    flat = {}
+    for key, value in point.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "."))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def attach_replays(handles : Dict[str, Dict]):
+    for day, handle in handles.items():
+        _replays[day] = MarketReplay.attach(handle)
+
+
+def run_point(index : int, day : str, trader_spec : str, params : Dict, verbose : bool = False) -> Dict:
+    trader = load_trader_class(trader_spec)(**params)
+    with trader_output(verbose):
+        profit_and_loss, _ = simulate(trader, _replays[day], progress=False)
+    return {"index": index, "day": day, "curve": profit_and_loss.sum(axis=0)}
+
+
+def sweep(filenames : List[Path], trader_spec : str, grid : Dict, workers : int = None, verbose : bool = False) -> pd.DataFrame:
+
+    points = expand_grid(grid)
+    trader_class = load_trader_class(trader_spec)
+
+    # Fail fast on parameters the trader does not know about
+    for point in points:
+        trader_class(**point)
+
+    # Load every day once and share the arrays with all workers
+    handles, blocks = {}, []
+    for filename in filenames:
+        handles[str(filename)], day_blocks = load_replay(filename, replay_products).share()
+        blocks.extend(day_blocks)
+
+    curves = {}
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach_replays, initargs=(handles,)) as executor:
+            futures = [
+                executor.submit(run_point, index, day, trader_spec, point, verbose)
+                for index, point in enumerate(points)
+                for day in handles
+            ]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                result = future.result()
+                curves[(result["index"], result["day"])] = result["curve"]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    rows = []
+    for index, point in enumerate(points):
+
+        # Chain the days in the order they were given, each day starts where the last one ended
+        offset, chained = 0.0, []
+        for day in handles:
+            chained.append(curves[(index, day)] + offset)
+            offset = chained[-1][-1]
+        chained = np.concatenate(chained)
+
+        rows.append({**flatten(point), "total": chained[-1], "max_drawdown": max_drawdown(chained)})
+
+    return pd.DataFrame(rows).sort_values(["total", "max_drawdown"], ascending=[False, True]).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prices", type=Path, nargs="+", required=True)
+    parser.add_argument("--trader", type=str, default="trader.Trader")
+    parser.add_argument("--grid", type=Path, required=True)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--out_file", type=Path, default=None)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    grid = json.load(open(args.grid, "r"))
+    ranking = sweep(args.prices, args.trader, grid, args.workers, args.verbose)
+    print(ranking.head(args.top).to_string())
+
+    if args.out_file is not None:
+        ranking.to_csv(args.out_file, sep=";", index=False)
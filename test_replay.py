@@ -0,0 +1,37 @@
+import io
+import pandas as pd
+from replay import MarketReplay
+
+PRICES = """day;timestamp;product;bid_price_1;bid_volume_1;bid_price_2;bid_volume_2;bid_price_3;bid_volume_3;ask_price_1;ask_volume_1;ask_price_2;ask_volume_2;ask_price_3;ask_volume_3;mid_price;profit_and_loss
+0;0;PEARLS;9999;9;9998;20;;;10003;14;10004;8;10005;23;10001.0;0.0
+0;0;BANANAS;4948;13;4947;19;;;4952;3;;;;;4950.0;0.0
+0;100;PEARLS;9996;1;9995;20;9996;4;9998;5;9998;29;10002;3;9997.0;0.0
+0;100;BANANAS;4949;2;4949;11;4948;7;4951;6;4952;1;4951;2;4950.0;0.0
+"""
+
+
+def order_depth_levels(order_depths):
+    return {
+        product: (list(order_depth.buy_orders.items()), list(order_depth.sell_orders.items()))
+        for product, order_depth in order_depths.items()
+    }
+
+
+def test_packed_order_depths_equal_dict_order_depths():
+    replay = MarketReplay.from_frame(pd.read_csv(io.StringIO(PRICES), sep=";"))
+    for t in range(len(replay)):
+        replay.packed = False
+        expected = order_depth_levels(replay.order_depths(t))
+        replay.packed = True
+        assert order_depth_levels(replay.order_depths(t)) == expected
+
+
+def test_duplicate_prices_are_merged():
+    replay = MarketReplay.from_frame(pd.read_csv(io.StringIO(PRICES), sep=";"))
+    replay.packed = True
+    order_depth = replay.order_depths(1)["PEARLS"]
+
+    assert dict(order_depth.buy_orders) == {9996: 5, 9995: 20}
+    assert dict(order_depth.sell_orders) == {9998: -34, 10002: -3}
+    assert order_depth.sell_orders[9998] == -34
+    assert repr(order_depth.sell_orders) == repr({9998: -34, 10002: -3})
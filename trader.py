@@ -1,8 +1,15 @@
 from typing import Dict, List
+from collections import deque
 from copy import deepcopy
+import bisect
+import itertools
 import numpy as np
-from statistics import mean, median
 from datamodel import OrderDepth, TradingState, Order
+from hedge import RollingHedge
+from ledger import LotAges, LotLedger
+from orderbook import MidPriceCache
+from rules import Inventory, Rule, TickFeatures
+from signals import StreamingSignal
 
 COMMODITIES = ["BANANAS", "COCONUTS", "PINA_COLADAS", "DIVING_GEAR", "BERRIES"]
 POSITION_LIMITS = {"PEARLS": 20, "BANANAS": 20, "COCONUTS":600, "PINA_COLADAS": 300, "DIVING_GEAR": 50, "BERRIES": 250}
@@ -17,43 +24,33 @@ CAN_SHORT = {"BANANAS": True, "COCONUTS": False, "PINA_COLADAS": True, "BERRIES"
 BUY_MARGIN = {"BANANAS": 1, "BERRIES": 1}
 SELL_MARGIN = {"BANANAS": 1, "BERRIES": 1}
 
+# [CLOSE LONG, OPEN SHORT, CLOSE SHORT, OPEN LONG], see rules.py for the features. Only the close rules get an inventory
 INITIAL_CONDITIONS = [
-    lambda price, slw_bid, slw_ask, positions, volume, time: price > np.mean(np.array(positions[:volume]))\
-        or np.mean(np.array(time[:volume])) > 150,
-    lambda price, slw_bid, slw_ask, positions, volume, time: price > slw_ask.get_percentile(10)-2 \
-        and slw_ask.length() > 2,
-    lambda price, slw_bid, slw_ask, positions, volume, time: price < np.mean(np.array(positions[:volume]))\
-        or np.mean(np.array(time[:volume])) > 180,
-    lambda price, slw_bid, slw_ask, positions, volume, time: price <= slw_bid.get_percentile(90) \
-        and slw_bid.length() > 2]
+    Rule("(price > entry_first) | (age_first > 150)"),
+    Rule("(price > ask_percentile(10) - 2) & (ask_length > 2)"),
+    Rule("(price < entry_first) | (age_first > 180)"),
+    Rule("(price <= bid_percentile(90)) & (bid_length > 2)")]
 
 
 # [CLOSE LONG, OPEN SHORT, CLOSE SHORT, OPEN LONG]
 DECISION_CONDITIONS = {"BANANAS": INITIAL_CONDITIONS, "COCONUTS": INITIAL_CONDITIONS, "PINA_COLADAS": INITIAL_CONDITIONS, "BERRIES": INITIAL_CONDITIONS, "DIVING_GEAR": INITIAL_CONDITIONS}
-DECISION_CONDITIONS["DIVING_GEAR"] = [
-    lambda price, slw_bid, slw_ask, positions, volume, time: price > np.mean(np.array(positions[:volume]))\
-        or np.mean(np.array(time[-volume:])) > 10000,
-    lambda price, slw_bid, slw_ask, positions, volume, time: price > slw_bid.get_percentile(50) \
-        and slw_ask.length() > 2,
-    lambda price, slw_bid, slw_ask, positions, volume, time: price < np.mean(np.array(positions[:volume]))\
-        or np.mean(np.array(time[:volume])) > 5000,
-    lambda price, slw_bid, slw_ask, positions, volume, time: price <= slw_ask.get_percentile(50) \
-        and slw_bid.length() > 2]
-DECISION_CONDITIONS["BERRIES"] = [
-    lambda price, slw_bid, slw_ask, positions, volume, time: price > np.mean(np.array(positions[:volume]))\
-        or np.mean(np.array(time[-volume:])) > 10000,
-    lambda price, slw_bid, slw_ask, positions, volume, time: price > slw_bid.get_percentile(50) \
-        and slw_ask.length() > 2,
-    lambda price, slw_bid, slw_ask, positions, volume, time: price < np.mean(np.array(positions[:volume]))\
-        or np.mean(np.array(time[:volume])) > 5000,
-    lambda price, slw_bid, slw_ask, positions, volume, time: price <= slw_ask.get_percentile(50) \
-        and slw_bid.length() > 2]
+def make_decision_conditions(close_long_age=10000, open_short_percentile=50, close_short_age=5000, open_long_percentile=50):
+    # [CLOSE LONG, OPEN SHORT, CLOSE SHORT, OPEN LONG], the parameters can be arrays of variants
+    return [
+        Rule("(price > entry_first) | (age_last > close_long_age)", close_long_age=close_long_age),
+        Rule("(price > bid_percentile(open_short_percentile)) & (ask_length > 2)", open_short_percentile=open_short_percentile),
+        Rule("(price < entry_first) | (age_first > close_short_age)", close_short_age=close_short_age),
+        Rule("(price <= ask_percentile(open_long_percentile)) & (bid_length > 2)", open_long_percentile=open_long_percentile)]
+
+
+DECISION_CONDITIONS["DIVING_GEAR"] = make_decision_conditions()
+DECISION_CONDITIONS["BERRIES"] = make_decision_conditions()
 
 
 
 class Trader:
 
-    def __init__(self):
+    def __init__(self, coco_pina_params : Dict = None, condition_params : Dict[str, Dict] = None):
         self.sliding_window_size = STAT_SLIDING_WINDOW_SIZE
         self.product_stats = {}
         self.sliding_window_means = []
@@ -64,15 +61,23 @@ class Trader:
 
         
         # JOHAN
-        self.states : List[Dict] = []
         self.time : int = 0
         self.hard_limit = False
 
-        self.johan_short_positions = { c:[] for c in COMMODITIES}
-        self.johan_long_positions = { c:[] for c in COMMODITIES}
+        self.johan_ledgers = { c:LotLedger() for c in COMMODITIES}
         self.cumulative_profit = { c:0 for c in COMMODITIES}
         self.johan_can_trade = { c:True for c in COMMODITIES}
 
+        # Tunable parameters, the defaults are the ones we submit
+        self.coco_pina_params = coco_pina_params or {}
+        self.coco_pina_cls = CocoPinaCls(**self.coco_pina_params)
+        self.decision_conditions = dict(DECISION_CONDITIONS)
+        for product, params in (condition_params or {}).items():
+            self.decision_conditions[product] = make_decision_conditions(**params)
+
+        # Streaming features of the observations, by product
+        self.observation_signals : Dict[str, StreamingSignal] = {}
+
     def run(self, state: TradingState) -> Dict[str, List[Order]]:
         """
         Only method required. It takes all buy and sell orders for all symbols as an input,
@@ -81,6 +86,12 @@ class Trader:
         # Initialize the method output dict as an empty dict
         result = {}
 
+        # Observations such as DOLPHIN_SIGHTINGS, only their streaming features are kept
+        for product, value in state.observations.items():
+            if product not in self.observation_signals:
+                self.observation_signals[product] = StreamingSignal()
+            self.observation_signals[product].update(value)
+
         # Vu initializations
 
         # JOHAN
@@ -90,271 +101,23 @@ class Trader:
             if not product in position:
                 position[product] = 0
 
-        self.states.append(state)
-        
-        coco_pina_cls = CocoPinaCls()
-
         # Iterate over all the keys (the available products) contained in the order depths
         for product in state.order_depths.keys():
 
-
-            # Check if the current product is the 'PEARLS' product, only then run the order logic
+            # Each branch is its own method so that it can be timed on its own, see profiler.py
             if product == 'PEARLS':
-                # Retrieve the Order Depth containing all the market BUY and SELL orders for PEARLS
-                order_depth: OrderDepth = state.order_depths[product]
-
-                # Initialize the list of Orders to be sent as an empty list
-                orders: list[Order] = []
-                acceptable_price = 10000
-
-                if len(order_depth.sell_orders) > 0:
-                    # Sort and check whether any orders
-                    for ask_price in [sorted(order_depth.sell_orders.keys())[0]]:
-                        if ask_price >= acceptable_price + 1:
-                            break
-                        if ask_price < acceptable_price:
-                            ask_volume = order_depth.sell_orders[ask_price]
-                            print("BUY PEARLS", str(-ask_volume) + "x", ask_price)
-                            orders.append(Order(product, ask_price, -ask_volume))
-                        else:
-                            ask_volume = POSITION_LIMITS[product] // 4
-                            orders.append(Order(product, ask_price, -ask_volume))
-                if len(order_depth.buy_orders) != 0:
-                    for ask_price in [sorted(order_depth.buy_orders.keys(), reverse=True)[0]]:
-                        if ask_price <= acceptable_price - 1:
-                            break
-                        if ask_price <= acceptable_price:
-                            ask_volume = order_depth.buy_orders[ask_price]
-                            print("SELL PEARLS", str(ask_volume) + "x", ask_price)
-                            orders.append(Order(product, ask_price, -ask_volume))
-                        else:
-                            ask_volume = POSITION_LIMITS[product] // 4
-                            print("SELL PEARLS", str(ask_volume) + "x", ask_price)
-                            orders.append(Order(product, ask_price, -ask_volume))
-                result[product] = orders
+                result[product] = self.run_pearls(state, product)
             elif product == 'PINA_COLADAS' or product == 'COCONUTS':
-                # MAX / JOHAN
-                diffs = coco_pina_cls(self.states)
-                if diffs is None or not product in diffs:
-                    continue
-
-                diff = diffs[product]
-                if abs(position[product] + diff) > self.limits[product]:
-                    if self.hard_limit:
-                        raise Exception(f"Position limit exceeded for {product}: old_position={position[product]}, diff={diff}")
-                    else:
-                        diff = max(diff, -self.limits[product] - position[product])
-                        diff = min(diff, self.limits[product] - position[product])
-                        diffs[product] = diff
-            
-                if diff > 0 and self.johan_can_trade[product]:
-                    result[product] = self.buy(product, diff, state.order_depths[product])
-                elif diff < 0 and self.johan_can_trade[product]:
-                    result[product] = self.sell(product, -diff, state.order_depths[product])
-                    
-                    
+                orders = self.run_coco_pina(state, product, position)
+                if orders is not None:
+                    result[product] = orders
             elif product == 'DOLPHIN_SIGHTINGS':
-                # TODO: use dolphin knowledge, DOLPHIN_SIGHTINGS is not a tradable good!
+                # Not a tradable good, it comes in the observations, see observation_signals
                 continue
             elif product == 'BERRIES' or product == 'BANANAS': #! this is now for BANANAS and BERRIES rn
-                if product not in self.product_stats.keys():
-                    sliding_window_ask = SlidingWindowStatistics(STAT_SLIDING_WINDOW_SIZE, str(product) + "_ASK")
-                    sliding_window_bid = SlidingWindowStatistics(STAT_SLIDING_WINDOW_SIZE, str(product) + "_BID")
-                    self.product_stats[product] = [sliding_window_ask, sliding_window_bid, {
-                        'bid_hist': [],
-                        'ask_hist': [],
-                        'ask_price': [],
-                        'bid_price': []
-                    }, [], [], [], []]
-
-                order_depth: OrderDepth = state.order_depths[product]
-                orders: list[Order] = []
-
-                sliding_window_ask = self.product_stats[product][0]
-                sliding_window_bid = self.product_stats[product][1]
-                best_prices = self.product_stats[product][2]
-                long_positions = self.product_stats[product][3]
-                short_positions = self.product_stats[product][4]
-                long_time = self.product_stats[product][5]
-                short_time = self.product_stats[product][6]
-
-                if PRINT_PRODUCTS[product]:
-                    sliding_window_ask.add(order_depth.sell_orders)
-                    sliding_window_bid.add(order_depth.buy_orders)
-
-                if len(order_depth.sell_orders) > 0:
-                    ask_price = list(sorted(order_depth.sell_orders.keys()))[0]
-                    best_prices['ask_price'].append(ask_price)
-                    if len(best_prices['ask_price']) > STAT_SLIDING_WINDOW_SIZE:
-                        best_prices['ask_price'].pop(0)
-
-                if len(order_depth.buy_orders) > 0:
-                    bid_price = list(sorted(order_depth.buy_orders.keys(), reverse=True))[0]
-                    best_prices['bid_price'].append(bid_price)
-                    if len(best_prices['bid_price']) > STAT_SLIDING_WINDOW_SIZE:
-                        best_prices['bid_price'].pop(0)
-
-                curr_value = 0.5* sum([sum(best_prices[val]) / len(best_prices[val]) for val in ['ask_price', 'bid_price']])
-
-                if ask_price:
-                    if ask_price < curr_value:
-                        ask_volume = order_depth.sell_orders[ask_price]
-                        orders.append(Order(product, ask_price, -ask_volume))
-                        short_positions += [ask_price for i in range(abs(ask_volume))]
-                    if ask_price - curr_value/5000 > curr_value:
-                        orders.append(Order(product, ask_price - (int(curr_value/5000)+1), -POSITION_LIMITS[product]//4))
-                        short_positions += [ask_price for i in range(abs(POSITION_LIMITS[product]//4))]
-                    if ask_price > curr_value:
-                        orders.append(Order(product, ask_price, -POSITION_LIMITS[product]//4))
-                        short_positions += [ask_price for i in range(abs(POSITION_LIMITS[product]//4))]
-
-                if bid_price:
-                    if bid_price > curr_value:
-                        bid_volume = order_depth.buy_orders[bid_price]
-                        orders.append(Order(product, bid_price, -bid_volume))
-                        long_positions += [ask_price for i in range(abs(bid_volume))]
-
-                    if bid_price + curr_value/5000 < curr_value:
-                        orders.append(Order(product, bid_price + (int(curr_value/5000)+1), POSITION_LIMITS[product] // 4))
-                        long_positions += [ask_price for i in range(abs(POSITION_LIMITS[product] // 4))]
-                    if bid_price < curr_value:
-                        orders.append(Order(product, bid_price, POSITION_LIMITS[product] // 4))
-                        long_positions += [ask_price for i in range(abs(POSITION_LIMITS[product] // 4))]
-
-                short_time = list(map(lambda n: n+1, short_time))
-                long_time = list(map(lambda n: n+1, long_time))
-
-                self.product_stats[product][0] = sliding_window_ask
-                self.product_stats[product][1] = sliding_window_bid
-                self.product_stats[product][2] = best_prices
-                self.product_stats[product][3] = long_positions
-                self.product_stats[product][4] = short_positions
-                self.product_stats[product][5] = long_time
-                self.product_stats[product][6] = short_time
-
-                # Add all the above orders to the result dict
-                result[product] = orders
+                result[product] = self.run_bananas_berries(state, product)
             elif product == 'DIVING_GEAR':
-                if product not in self.product_stats.keys():
-                    sliding_window_ask = SlidingWindowStatistics(STAT_SLIDING_WINDOW_SIZE, str(product) + "_ASK")
-                    sliding_window_bid = SlidingWindowStatistics(STAT_SLIDING_WINDOW_SIZE, str(product) + "_BID")
-                    self.product_stats[product] = [sliding_window_ask, sliding_window_bid, [], [], [], []]
-
-                order_depth: OrderDepth = state.order_depths[product]
-                orders: list[Order] = []
-
-                sliding_window_ask = self.product_stats[product][0]
-                sliding_window_bid = self.product_stats[product][1]
-                long_positions = self.product_stats[product][2]
-                short_positions = self.product_stats[product][3]
-                long_time = self.product_stats[product][4]
-                short_time = self.product_stats[product][5]
-
-                def update_long_short():
-                    # if len(short_positions) > 0:
-                    #     CAN_LONG[product] = False
-                    #     CAN_SHORT[product] = True
-                    # if len(short_positions) == 0:
-                    #     CAN_SHORT[product] = True
-                    #     CAN_LONG[product] = False
-                    # if len(long_positions) > 0:
-                    #     CAN_SHORT[product] = False
-                    #     CAN_LONG[product] = True
-                    # if len(short_positions) == 0:
-                    #     CAN_LONG[product] = True
-                    #     CAN_SHORT[product] = False
-                    pass
-
-
-                if PRINT_PRODUCTS[product]:
-                    sliding_window_ask.add(order_depth.sell_orders)
-                    sliding_window_bid.add(order_depth.buy_orders)
-
-                if len(order_depth.buy_orders) > 0:
-                    num_long_positions = len(long_positions)
-                    num_short_positions = len(short_positions)
-                    can_short = True
-                    print("bot bid depths: ", str(order_depth.buy_orders))
-
-                    # CLOSE LONG
-                    for bid_price in sorted(order_depth.buy_orders.keys(), reverse=True):
-                        bid_volume = min(order_depth.buy_orders[bid_price], num_long_positions)
-                        # if bid_price > np.mean(np.array(long_positions[:bid_volume])) \
-                        #     or np.mean(np.array(long_time[:bid_volume])) > 150 and can_long:
-                        if DECISION_CONDITIONS[product][0](bid_price, sliding_window_bid, sliding_window_ask,\
-                            long_positions, bid_volume, long_time):
-                            print(f"SELL {product} LONG", str(bid_volume) + "x", bid_price)
-                            orders.append(Order(product, bid_price, -bid_volume))
-                            num_long_positions -= bid_volume
-                            long_positions = long_positions[bid_volume:]
-                            long_time = long_time[bid_volume:]
-                            update_long_short()
-
-                    # OPEN SHORT
-                    for bid_price in sorted(order_depth.buy_orders.keys()):
-                        bid_volume = min(order_depth.buy_orders[bid_price], POSITION_LIMITS[product] - num_short_positions)
-                        # if bid_price > sliding_window_ask.get_percentile(10) - 2 and len(
-                        #         sliding_window_ask.sliding_window) > 2 and can_short:
-                        if DECISION_CONDITIONS[product][1](bid_price, sliding_window_bid, sliding_window_ask,\
-                            short_time, bid_volume, short_time) and CAN_SHORT[product]:
-                            print(f"SELL {product} SHORT", str(bid_volume) + "x", bid_price)
-                            orders.append(Order(product, bid_price, -bid_volume))
-                            num_short_positions += abs(bid_volume)
-                            short_positions += [bid_price for x in range(abs(bid_volume))]
-                            short_time += [0 for x in range(abs(bid_volume))]
-                            update_long_short()
-
-                if len(order_depth.sell_orders) > 0:
-                    num_long_positions = len(long_positions)
-                    num_short_positions = len(short_positions)
-                    can_short = True
-                    can_long = True
-
-                    # CLOSE SHORT
-                    for ask_price in sorted(order_depth.sell_orders.keys(), reverse=True):
-                        ask_volume = max(order_depth.sell_orders[ask_price], -(num_short_positions))
-                        # bug: should do abs(ask_volume), but nothing has beaten this...
-                        # if ask_price < np.mean(np.array(short_positions[:ask_volume])) - 2 \
-                        #     or np.mean(np.array(short_time[:ask_volume])) > 180 and can_short:
-                        if DECISION_CONDITIONS[product][2](ask_price, sliding_window_bid, sliding_window_ask,\
-                            short_positions, ask_volume, short_time):
-                            print(f"BUY {product} SHORT", str(-ask_volume) + "x", ask_price)
-                            orders.append(Order(product, ask_price, -ask_volume))
-                            num_short_positions -= ask_volume
-                            short_positions = short_positions[abs(ask_volume):]
-                            short_time = short_time[abs(ask_volume):]
-                            update_long_short()
-
-                    # OPEN LONG
-                    print("bot ask depths: " + str(order_depth.sell_orders))
-                    for ask_price in sorted(order_depth.sell_orders.keys()):
-                        ask_volume = max(order_depth.sell_orders[ask_price], -(POSITION_LIMITS[product] - (num_long_positions)))
-                        # if ask_price <= sliding_window_bid.get_percentile(90) and len(
-                        #     sliding_window_bid.sliding_window) > 2 and can_long:
-                        if DECISION_CONDITIONS[product][3](ask_price, sliding_window_bid, sliding_window_ask,\
-                            long_positions, ask_volume, long_time) and CAN_LONG[product]:
-                            print(f"BUY {product} LONG", str(-ask_volume) + "x", ask_price)
-                            orders.append(Order(product, ask_price, -ask_volume))
-                            num_long_positions -= ask_volume
-                            long_positions += [ask_price for x in range(abs(ask_volume))]
-                            long_time += [0 for x in range(abs(ask_volume))]
-                            update_long_short()
-
-                short_time = list(map(lambda n: n+1, short_time))
-                long_time = list(map(lambda n: n+1, long_time))
-
-                self.product_stats[product][0] = sliding_window_ask
-                self.product_stats[product][1] = sliding_window_bid
-                self.product_stats[product][2] = long_positions
-                self.product_stats[product][3] = short_positions
-                self.product_stats[product][4] = long_time
-                self.product_stats[product][5] =  short_time
-
-                
-
-                # Add all the above orders to the result dict
-                result[product] = orders
-
+                result[product] = self.run_diving_gear(state, product)
 
         for product in self.product_stats.keys():
 
@@ -377,9 +140,270 @@ class Trader:
         if self.cumulative_profit["COCONUTS"] > 9000:
             self.johan_can_trade["COCONUTS"] = False
 
-
         return result
 
+    def run_pearls(self, state : TradingState, product : str) -> List[Order]:
+        # Retrieve the Order Depth containing all the market BUY and SELL orders for PEARLS
+        order_depth: OrderDepth = state.order_depths[product]
+
+        # Initialize the list of Orders to be sent as an empty list
+        orders: list[Order] = []
+        acceptable_price = 10000
+
+        if len(order_depth.sell_orders) > 0:
+            # Sort and check whether any orders
+            for ask_price in [sorted(order_depth.sell_orders.keys())[0]]:
+                if ask_price >= acceptable_price + 1:
+                    break
+                if ask_price < acceptable_price:
+                    ask_volume = order_depth.sell_orders[ask_price]
+                    print("BUY PEARLS", str(-ask_volume) + "x", ask_price)
+                    orders.append(Order(product, ask_price, -ask_volume))
+                else:
+                    ask_volume = POSITION_LIMITS[product] // 4
+                    orders.append(Order(product, ask_price, -ask_volume))
+        if len(order_depth.buy_orders) != 0:
+            for ask_price in [sorted(order_depth.buy_orders.keys(), reverse=True)[0]]:
+                if ask_price <= acceptable_price - 1:
+                    break
+                if ask_price <= acceptable_price:
+                    ask_volume = order_depth.buy_orders[ask_price]
+                    print("SELL PEARLS", str(ask_volume) + "x", ask_price)
+                    orders.append(Order(product, ask_price, -ask_volume))
+                else:
+                    ask_volume = POSITION_LIMITS[product] // 4
+                    print("SELL PEARLS", str(ask_volume) + "x", ask_price)
+                    orders.append(Order(product, ask_price, -ask_volume))
+        return orders
+
+    def run_coco_pina(self, state : TradingState, product : str, position : Dict[str, int]) -> List[Order]:
+        # MAX / JOHAN
+        diffs = self.coco_pina_cls(state)
+        if diffs is None or not product in diffs:
+            return None
+
+        diff = diffs[product]
+        if abs(position[product] + diff) > self.limits[product]:
+            if self.hard_limit:
+                raise Exception(f"Position limit exceeded for {product}: old_position={position[product]}, diff={diff}")
+            else:
+                diff = max(diff, -self.limits[product] - position[product])
+                diff = min(diff, self.limits[product] - position[product])
+                diffs[product] = diff
+
+        if diff > 0 and self.johan_can_trade[product]:
+            return self.buy(product, diff, state.order_depths[product])
+        elif diff < 0 and self.johan_can_trade[product]:
+            return self.sell(product, -diff, state.order_depths[product])
+        return None
+
+    def run_bananas_berries(self, state : TradingState, product : str) -> List[Order]:
+        if product not in self.product_stats.keys():
+            sliding_window_ask = SlidingWindowStatistics(STAT_SLIDING_WINDOW_SIZE, str(product) + "_ASK")
+            sliding_window_bid = SlidingWindowStatistics(STAT_SLIDING_WINDOW_SIZE, str(product) + "_BID")
+            self.product_stats[product] = [sliding_window_ask, sliding_window_bid, {
+                'bid_hist': [],
+                'ask_hist': [],
+                'ask_price': [],
+                'bid_price': []
+            }, [], [], LotAges(), LotAges()]
+
+        order_depth: OrderDepth = state.order_depths[product]
+        orders: list[Order] = []
+
+        sliding_window_ask = self.product_stats[product][0]
+        sliding_window_bid = self.product_stats[product][1]
+        best_prices = self.product_stats[product][2]
+        long_positions = self.product_stats[product][3]
+        short_positions = self.product_stats[product][4]
+        long_ages = self.product_stats[product][5]
+        short_ages = self.product_stats[product][6]
+
+        if PRINT_PRODUCTS[product]:
+            sliding_window_ask.add(order_depth.sell_orders)
+            sliding_window_bid.add(order_depth.buy_orders)
+
+        # A side without orders places nothing on that side
+        ask_price, bid_price = None, None
+        if len(order_depth.sell_orders) > 0:
+            ask_price = list(sorted(order_depth.sell_orders.keys()))[0]
+            best_prices['ask_price'].append(ask_price)
+            if len(best_prices['ask_price']) > STAT_SLIDING_WINDOW_SIZE:
+                best_prices['ask_price'].pop(0)
+
+        if len(order_depth.buy_orders) > 0:
+            bid_price = list(sorted(order_depth.buy_orders.keys(), reverse=True))[0]
+            best_prices['bid_price'].append(bid_price)
+            if len(best_prices['bid_price']) > STAT_SLIDING_WINDOW_SIZE:
+                best_prices['bid_price'].pop(0)
+
+        curr_value = 0.5* sum([sum(best_prices[val]) / len(best_prices[val]) for val in ['ask_price', 'bid_price']])
+
+        if ask_price:
+            if ask_price < curr_value:
+                ask_volume = order_depth.sell_orders[ask_price]
+                orders.append(Order(product, ask_price, -ask_volume))
+                short_positions += [ask_price for i in range(abs(ask_volume))]
+            if ask_price - curr_value/5000 > curr_value:
+                orders.append(Order(product, ask_price - (int(curr_value/5000)+1), -POSITION_LIMITS[product]//4))
+                short_positions += [ask_price for i in range(abs(POSITION_LIMITS[product]//4))]
+            if ask_price > curr_value:
+                orders.append(Order(product, ask_price, -POSITION_LIMITS[product]//4))
+                short_positions += [ask_price for i in range(abs(POSITION_LIMITS[product]//4))]
+
+        if bid_price:
+            if bid_price > curr_value:
+                bid_volume = order_depth.buy_orders[bid_price]
+                orders.append(Order(product, bid_price, -bid_volume))
+                long_positions += [ask_price for i in range(abs(bid_volume))]
+
+            if bid_price + curr_value/5000 < curr_value:
+                orders.append(Order(product, bid_price + (int(curr_value/5000)+1), POSITION_LIMITS[product] // 4))
+                long_positions += [ask_price for i in range(abs(POSITION_LIMITS[product] // 4))]
+            if bid_price < curr_value:
+                orders.append(Order(product, bid_price, POSITION_LIMITS[product] // 4))
+                long_positions += [ask_price for i in range(abs(POSITION_LIMITS[product] // 4))]
+
+        short_ages.advance()
+        long_ages.advance()
+
+        self.product_stats[product][0] = sliding_window_ask
+        self.product_stats[product][1] = sliding_window_bid
+        self.product_stats[product][2] = best_prices
+        self.product_stats[product][3] = long_positions
+        self.product_stats[product][4] = short_positions
+        self.product_stats[product][5] = long_ages
+        self.product_stats[product][6] = short_ages
+
+        # Add all the above orders to the result dict
+        return orders
+
+    def run_diving_gear(self, state : TradingState, product : str) -> List[Order]:
+        if product not in self.product_stats.keys():
+            sliding_window_ask = SlidingWindowStatistics(STAT_SLIDING_WINDOW_SIZE, str(product) + "_ASK")
+            sliding_window_bid = SlidingWindowStatistics(STAT_SLIDING_WINDOW_SIZE, str(product) + "_BID")
+            self.product_stats[product] = [sliding_window_ask, sliding_window_bid, [], [], LotAges(), LotAges()]
+
+        order_depth: OrderDepth = state.order_depths[product]
+        orders: list[Order] = []
+
+        sliding_window_ask = self.product_stats[product][0]
+        sliding_window_bid = self.product_stats[product][1]
+        long_positions = self.product_stats[product][2]
+        short_positions = self.product_stats[product][3]
+        long_ages = self.product_stats[product][4]
+        short_ages = self.product_stats[product][5]
+
+        # Passed to the decision conditions, None until the first observation
+        dolphins = self.observation_signals.get('DOLPHIN_SIGHTINGS')
+        conditions = self.decision_conditions[product]
+
+        def update_long_short():
+            # if len(short_positions) > 0:
+            #     CAN_LONG[product] = False
+            #     CAN_SHORT[product] = True
+            # if len(short_positions) == 0:
+            #     CAN_SHORT[product] = True
+            #     CAN_LONG[product] = False
+            # if len(long_positions) > 0:
+            #     CAN_SHORT[product] = False
+            #     CAN_LONG[product] = True
+            # if len(short_positions) == 0:
+            #     CAN_LONG[product] = True
+            #     CAN_SHORT[product] = False
+            pass
+
+
+        if PRINT_PRODUCTS[product]:
+            sliding_window_ask.add(order_depth.sell_orders)
+            sliding_window_bid.add(order_depth.buy_orders)
+
+        # Features of the windows, shared by every level and rule of the tick
+        tick = TickFeatures(sliding_window_bid, sliding_window_ask, dolphins)
+
+        if len(order_depth.buy_orders) > 0:
+            num_long_positions = len(long_positions)
+            num_short_positions = len(short_positions)
+            can_short = True
+            longs = Inventory(long_positions, long_ages)
+            print("bot bid depths: ", str(order_depth.buy_orders))
+
+            # CLOSE LONG
+            for bid_price in sorted(order_depth.buy_orders.keys(), reverse=True):
+                bid_volume = min(order_depth.buy_orders[bid_price], num_long_positions)
+                # if bid_price > np.mean(np.array(long_positions[:bid_volume])) \
+                #     or np.mean(np.array(long_time[:bid_volume])) > 150 and can_long:
+                if conditions[0](bid_price, bid_volume, longs, tick):
+                    print(f"SELL {product} LONG", str(bid_volume) + "x", bid_price)
+                    orders.append(Order(product, bid_price, -bid_volume))
+                    num_long_positions -= bid_volume
+                    long_positions = long_positions[bid_volume:]
+                    long_ages.take(bid_volume)
+                    longs.take(bid_volume)
+                    update_long_short()
+
+            # OPEN SHORT
+            for bid_price in sorted(order_depth.buy_orders.keys()):
+                bid_volume = min(order_depth.buy_orders[bid_price], POSITION_LIMITS[product] - num_short_positions)
+                # if bid_price > sliding_window_ask.get_percentile(10) - 2 and len(
+                #         sliding_window_ask.sliding_window) > 2 and can_short:
+                if conditions[1](bid_price, bid_volume, None, tick) and CAN_SHORT[product]:
+                    print(f"SELL {product} SHORT", str(bid_volume) + "x", bid_price)
+                    orders.append(Order(product, bid_price, -bid_volume))
+                    num_short_positions += abs(bid_volume)
+                    short_positions += [bid_price for x in range(abs(bid_volume))]
+                    short_ages.add(abs(bid_volume))
+                    update_long_short()
+
+        if len(order_depth.sell_orders) > 0:
+            num_long_positions = len(long_positions)
+            num_short_positions = len(short_positions)
+            can_short = True
+            can_long = True
+            shorts = Inventory(short_positions, short_ages)
+
+            # CLOSE SHORT
+            for ask_price in sorted(order_depth.sell_orders.keys(), reverse=True):
+                ask_volume = max(order_depth.sell_orders[ask_price], -(num_short_positions))
+                # bug: should do abs(ask_volume), but nothing has beaten this...
+                # if ask_price < np.mean(np.array(short_positions[:ask_volume])) - 2 \
+                #     or np.mean(np.array(short_time[:ask_volume])) > 180 and can_short:
+                if conditions[2](ask_price, ask_volume, shorts, tick):
+                    print(f"BUY {product} SHORT", str(-ask_volume) + "x", ask_price)
+                    orders.append(Order(product, ask_price, -ask_volume))
+                    num_short_positions -= ask_volume
+                    short_positions = short_positions[abs(ask_volume):]
+                    short_ages.take(abs(ask_volume))
+                    shorts.take(ask_volume)
+                    update_long_short()
+
+            # OPEN LONG
+            print("bot ask depths: " + str(order_depth.sell_orders))
+            for ask_price in sorted(order_depth.sell_orders.keys()):
+                ask_volume = max(order_depth.sell_orders[ask_price], -(POSITION_LIMITS[product] - (num_long_positions)))
+                # if ask_price <= sliding_window_bid.get_percentile(90) and len(
+                #     sliding_window_bid.sliding_window) > 2 and can_long:
+                if conditions[3](ask_price, ask_volume, None, tick) and CAN_LONG[product]:
+                    print(f"BUY {product} LONG", str(-ask_volume) + "x", ask_price)
+                    orders.append(Order(product, ask_price, -ask_volume))
+                    num_long_positions -= ask_volume
+                    long_positions += [ask_price for x in range(abs(ask_volume))]
+                    long_ages.add(abs(ask_volume))
+                    update_long_short()
+
+        short_ages.advance()
+        long_ages.advance()
+
+        self.product_stats[product][0] = sliding_window_ask
+        self.product_stats[product][1] = sliding_window_bid
+        self.product_stats[product][2] = long_positions
+        self.product_stats[product][3] = short_positions
+        self.product_stats[product][4] = long_ages
+        self.product_stats[product][5] = short_ages
+
+        # Add all the above orders to the result dict
+        return orders
+
     # JOHAN
     def buy(self, product : str, n : int, order_depth):
 
@@ -393,21 +417,9 @@ class Trader:
 
             # print("Sell orders :", order_depth.sell_orders)
             # print("Buy", product, ask_volume, n, curr_volume, ask_price, Order(product, ask_price, curr_volume))
-            remaining_buy_quantity = abs(curr_volume)
+            # close short, then open long
+            self.cumulative_profit[product] += self.johan_ledgers[product].fill(ask_price, abs(curr_volume))
 
-            # close short
-            if len(self.johan_short_positions[product]) > 0:
-                short_close_quantity = min(len(self.johan_short_positions[product]), remaining_buy_quantity)
-                self.cumulative_profit[product] += sum(self.johan_short_positions[product][:short_close_quantity]) - short_close_quantity * ask_price
-                self.johan_short_positions[product] = self.johan_short_positions[product][short_close_quantity:]
-                remaining_buy_quantity -= short_close_quantity
-
-            # open long
-            if len(self.johan_short_positions[product]) == 0 and remaining_buy_quantity > 0:
-                self.johan_long_positions[product].extend([ask_price for x in range(remaining_buy_quantity)])
-                remaining_buy_quantity = 0
-
-            
             # Place order
             orders.append(Order(product, ask_price, curr_volume))
 
@@ -431,17 +443,8 @@ class Trader:
             # print("Buy orders :", order_depth.buy_orders)
             # print("Sell", product, bid_volume, n, curr_volume, bid_price, Order(product, bid_price, -curr_volume))
             
-            remaining_sell_quantity = abs(curr_volume)
-            # close long
-            if len(self.johan_long_positions[product]) > 0:
-                long_close_quantity = min(len(self.johan_long_positions[product]), remaining_sell_quantity)
-                self.cumulative_profit[product] += long_close_quantity * bid_price - sum(self.johan_long_positions[product][:long_close_quantity])
-                self.johan_long_positions[product] = self.johan_long_positions[product][long_close_quantity:]
-                remaining_sell_quantity -= long_close_quantity
-            # open short
-            if len(self.johan_long_positions[product]) == 0:
-                self.johan_short_positions[product].extend([bid_price for x in range(remaining_sell_quantity)])
-                remaining_sell_quantity = 0
+            # close long, then open short
+            self.cumulative_profit[product] += self.johan_ledgers[product].fill(bid_price, -abs(curr_volume))
 
             # Place order
             orders.append(Order(product, bid_price, -curr_volume))
@@ -455,28 +458,53 @@ class Trader:
 
 
 class SlidingWindowStatistics:
+    """
+    Volume weighted statistics of the order depths seen in the last sliding_window_size ticks.
+    The window is kept as a price -> volume multiset that is updated as depths enter and leave
+    it, so no list with one entry per unit of volume is ever built.
+    """
 
     def __init__(self, sliding_window_size, statistics_type):
         self.sliding_window_size = sliding_window_size
-        self.sliding_window = []
+        self.sliding_window = deque()
         self.statistics_type = statistics_type
         self.mean = 10000
-        self.flat_list = []
+
+        # Live multiset of the window: price -> volume, its sorted prices and running totals
+        self.volumes = {}
+        self.prices = []
+        self.volume = 0
+        self.weighted_sum = 0
+
+        # Snapshot taken by update_stats, queries are answered from it
+        self.stat_prices = []
+        self.stat_cumulative = []
 
     def add(self, order_depth):
+        order_depth = dict(order_depth)
         self.sliding_window.append(order_depth)
+        self._update(order_depth, 1)
         if len(self.sliding_window) > self.sliding_window_size:
-            self.sliding_window = self.sliding_window[-self.sliding_window_size:]
-
-    # Outputs flat sorted list of orders in the sliding window
-    def flatten(self):
-        flat_list = []
-        for order_depth_dict in self.sliding_window:
-            for price in order_depth_dict:
-                flat_list.extend([price for x in range(abs(order_depth_dict[price]))])
+            self._update(self.sliding_window.popleft(), -1)
 
-        flat_list.sort()
-        return flat_list
+    def _update(self, order_depth_dict, sign):
+        for price, volume in order_depth_dict.items():
+            volume = abs(volume)
+            if volume == 0:
+                continue
+            if price not in self.volumes:
+                bisect.insort(self.prices, price)
+                self.volumes[price] = 0
+            self.volumes[price] += sign * volume
+            if self.volumes[price] == 0:
+                del self.volumes[price]
+                del self.prices[bisect.bisect_left(self.prices, price)]
+            self.volume += sign * volume
+            self.weighted_sum += sign * volume * price
+
+    # Unit at position index of the flat sorted list of orders in the snapshot
+    def _unit(self, index):
+        return self.stat_prices[bisect.bisect_right(self.stat_cumulative, index)]
 
     def should_act(self, curr_price, buy=True):
         order_depth_dict = self.sliding_window[0]
@@ -491,36 +519,48 @@ class SlidingWindowStatistics:
             return False
 
     def update_stats(self):
-        self.flat_list = self.flatten()
-        self.mean = np.mean(np.array(self.flat_list))
+        self.stat_prices = list(self.prices)
+        self.stat_cumulative = list(itertools.accumulate(self.volumes[price] for price in self.stat_prices))
+        self.mean = self.weighted_sum / self.volume if self.volume > 0 else float("nan")
 
     def get_mean(self):
         return self.mean
 
     def get_min(self):
-        if len(self.flat_list) > 0:
-            return self.flat_list[0]
+        if len(self.stat_prices) > 0:
+            return self.stat_prices[0]
         else:
             return 0
 
     def get_max(self):
-        if len(self.flat_list) > 0:
-            return self.flat_list[-1:][0]
+        if len(self.stat_prices) > 0:
+            return self.stat_prices[-1]
         else:
             return 0
 
     def get_percentile(self, perc):
-        if len(self.flat_list) > 0:
-            return int(np.percentile(np.array(self.flat_list), perc))
-        else:
+        if len(self.stat_prices) == 0:
             return 0
 
+        # Same linear interpolation as np.percentile on the flat list
+        index = (self.stat_cumulative[-1] - 1) * (perc / 100)
+        lower = int(index)
+        gamma = index - lower
+        below = self._unit(lower)
+        above = self._unit(min(lower + 1, self.stat_cumulative[-1] - 1))
+        if gamma >= 0.5:
+            return int(above - (above - below) * (1 - gamma))
+        return int(below + (above - below) * gamma)
+
+    def get_volume(self):
+        return self.stat_cumulative[-1] if len(self.stat_cumulative) > 0 else 0
+
     def length(self):
         return len(self.sliding_window)
 
     def print_stats(self):
         self.update_stats()
-        if len(self.flat_list) > 10:
+        if self.get_volume() > 10:
             output = "[" + str(self.statistics_type) + ","
             output += "mean:" + str(self.mean) + ","
             output += "min:" + str(self.get_min()) + ","
@@ -530,7 +570,7 @@ class SlidingWindowStatistics:
             output += "75th:" + str(self.get_percentile(75)) + ","
             output += "90th:" + str(self.get_percentile(90)) + ","
             output += "max:" + str(self.get_max()) + ","
-            output += "vol:" + str(len(self.flat_list))
+            output += "vol:" + str(self.get_volume())
             output += "]"
         else:
             output = "[" + str(self.statistics_type) + ", more data needed]"
@@ -539,76 +579,83 @@ class SlidingWindowStatistics:
 
 
 class CocoPinaCls:
-    def __init__(self):
+    def __init__(self, beta=0.5332246610399421, lag=5, slope_lag=5, threshold=20, warmup=30,
+                 small_size=5, large_size=10, exit_size=300, small_coco_sell_size=5, beta_window=None):
         self.limits = {
           "COCONUTS": 600,
           "PINA_COLADAS": 300
         }
-        self.beta = 0.5332246610399421
+        self.beta = beta
+
+        # With a beta_window, beta follows the rolling hedge ratio once that many ticks were seen
+        self.hedge = RollingHedge(beta_window) if beta_window else None
+        self.spread_zscore = np.nan
         
-        self.lag = 5
-        self.slope_lag = 5
-        self.spreads = []
+        self.lag = lag
+        self.slope_lag = slope_lag
         self.time = 0
+
+        # Only the last max(lag, slope_lag) ticks are ever looked at
+        history = max(lag, slope_lag)
+        self.coco_mids = deque(maxlen=history)
+        self.spreads = deque(maxlen=history)
+        self.mid_prices = MidPriceCache()
+        self.decision_timestamp = None
+        self.decision = None
+
+        # spread above which we go BOLD, ticks before the slope exits and order sizes
+        self.threshold = threshold
+        self.warmup = warmup
+        self.small_size = small_size
+        self.large_size = large_size
+        self.exit_size = exit_size
+        self.small_coco_sell_size = small_coco_sell_size
         
-    def __call__(self, states : List[Dict]):
-        pina_state = states[-1]
-        
-        if self.time >= self.lag:
-            coco_state = states[-1 - self.lag] 
-        else:
-            coco_state = pina_state
-        
-        coco_depths = coco_state.order_depths
-        # calculate mid price of COCONUTS
-        orders_coco = coco_depths['COCONUTS']
-        coco_buys = orders_coco.buy_orders
-        buys = []
-        for buy_price in coco_buys.keys():
-            buys += [buy_price] * coco_buys[buy_price]
-        median_price_buys = median(buys)
-        coco_sells = orders_coco.sell_orders
-        sells = []
-        for sell_price in coco_sells.keys():
-            sells += [sell_price] * (-coco_sells[sell_price])
-        median_price_sells = median(sells)
-        coco = mean([median_price_buys, median_price_sells])
+    def __call__(self, state : TradingState):
+        if state.timestamp == self.decision_timestamp:
+            return dict(self.decision)
         
-        pina_depths = pina_state.order_depths
-        # calculate mid price of PINA_COLADAS
-        orders_pina = pina_depths['PINA_COLADAS']
-        pina_buys = orders_pina.buy_orders
-        buys = []
-        for buy_price in pina_buys.keys():
-            buys += [buy_price] * pina_buys[buy_price]
-        median_price_buys = median(buys)
-        pina_sells = orders_pina.sell_orders
-        sells = []
-        for sell_price in pina_sells.keys():
-            sells += [sell_price] * (-pina_sells[sell_price])
-        median_price_sells = median(sells)
-        pina = mean([median_price_buys, median_price_sells])
+        # calculate mid prices of COCONUTS and PINA_COLADAS, each is computed once per tick
+        coco = self.mid_prices(state.timestamp, 'COCONUTS', state.order_depths['COCONUTS'])
+        pina = self.mid_prices(state.timestamp, 'PINA_COLADAS', state.order_depths['PINA_COLADAS'])
+
+        # PINA_COLADAS lead, compare them to the COCONUTS of lag ticks ago
+        lagged_coco = coco
+        if self.time >= self.lag and 0 < self.lag <= len(self.coco_mids):
+            lagged_coco = self.coco_mids[-self.lag]
+        self.coco_mids.append(coco)
+
+        if self.hedge is not None:
+            self.hedge.update(pina, lagged_coco)
+            if self.hedge.full():
+                self.beta = self.hedge.beta
+                self.spread_zscore = self.hedge.zscore(pina, lagged_coco)
         
         # calculate spread
-        spread = coco - self.beta * pina
-        if self.spreads == [] or self.spreads[-1] != spread:
+        spread = lagged_coco - self.beta * pina
+        if len(self.spreads) == 0 or self.spreads[-1] != spread:
             self.spreads.append(spread)
             self.time += 1
-            
-        if self.time >= 30 and self.time % 5 == 0 and spread < 0 and spread - self.spreads[-5] < 0:
-            return {'COCONUTS': -300, 'PINA_COLADAS': 0}
-        elif self.time >= 30 and self.time % 5 == 0 and spread > 0 and spread - self.spreads[-5] > 0:
-            return {'COCONUTS': 0, 'PINA_COLADAS': -300}
+
+        self.decision_timestamp = state.timestamp
+        self.decision = self.decide(spread)
+        return dict(self.decision)
+
+    def decide(self, spread : float) -> Dict[str, int]:
+        if self.time >= self.warmup and self.time % self.slope_lag == 0 and spread < 0 and spread - self.spreads[-self.slope_lag] < 0:
+            return {'COCONUTS': -self.exit_size, 'PINA_COLADAS': 0}
+        elif self.time >= self.warmup and self.time % self.slope_lag == 0 and spread > 0 and spread - self.spreads[-self.slope_lag] > 0:
+            return {'COCONUTS': 0, 'PINA_COLADAS': -self.exit_size}
         
         # if spread is negative, PINA_COLADAS are overpriced, otherwise COCONUTS are
         if spread < 0:
             # long cocos, short pinas, go BOLD
-            if abs(spread) > 20:
-                return {'COCONUTS': 10, 'PINA_COLADAS': -10}
+            if abs(spread) > self.threshold:
+                return {'COCONUTS': self.large_size, 'PINA_COLADAS': -self.large_size}
             else:
-                return {'COCONUTS': 5, 'PINA_COLADAS': -5}
+                return {'COCONUTS': self.small_size, 'PINA_COLADAS': -self.small_size}
         else:
-            if abs(spread) > 20:
-                return {'COCONUTS': -10, 'PINA_COLADAS': 10}
+            if abs(spread) > self.threshold:
+                return {'COCONUTS': -self.large_size, 'PINA_COLADAS': self.large_size}
             else:
-                return {'COCONUTS': -5, 'PINA_COLADAS': 5}
\ No newline at end of file
+                return {'COCONUTS': -self.small_coco_sell_size, 'PINA_COLADAS': self.small_size}
\ No newline at end of file
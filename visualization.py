@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import argparse
+from store import load_frame
 
 VOLUME_BINNING = 25
 
@@ -17,11 +18,11 @@ parser = argparse.ArgumentParser()
 parser.add_argument('--data', type=str, required=True, nargs='+')
 
 args = parser.parse_args()
-data = pd.read_csv(args.data[0], sep=';')
+data = load_frame(args.data[0])
 products = data['product'].unique()
 last_profits = get_last_profit_loss(data, products)
 for i in range(1, len(args.data)):
-    data_ = pd.read_csv(args.data[i], sep=';')
+    data_ = load_frame(args.data[i])
     for product, last_profit in zip(products, last_profits):
         data_prod = data_[data_['product'] == product]
         data_prod['profit_and_loss'] += last_profit